@@ -0,0 +1,310 @@
+import json
+import sqlite3
+import threading
+from collections import defaultdict
+
+import engine
+from codec import decode_state, encode_state
+from storage import connection_local
+
+# Per-player history of how each state came about, for support tickets and
+# load-test fixtures.
+#
+# Every saved change of a player's state is one entry
+#
+#   {'version': v, 'time': t, 'action': name or None, 'args': [...]}
+#
+# where v is the version the change produced. Replaying it means advancing
+# the state at version v - 1 to `time` and running engine.run_action() with
+# `args` (no action for a save that only let time pass), both with
+# engine.transition_rng(), so every roll comes out as it did live. Changes
+# that replace the state outright (a new game, a reset, an import) can't be
+# replayed and are snapshotted instead, as is a state migrated from an old
+# cookie or from before this log.
+#
+# A snapshot of the state is also taken every `snapshot_interval` versions, so
+# a replay starts from the closest one and applies at most that many entries.
+# Compaction, in the background, keeps the newest `retention` snapshots of
+# each player and drops the entries the oldest of them makes unnecessary.
+#
+# Entries are buffered and written in batches by the background thread; the
+# store stays the authority on the current state, the log only explains it.
+
+REPLACING_ACTIONS = ('new_game', 'reset', 'import_save', 'migrate')
+
+
+class ReplayError(Exception):
+    """The history can't be replayed to the version asked for"""
+
+
+def apply_entry(game_state, entry):
+    """Replay one entry on the state at the version before it"""
+    if entry['action'] in REPLACING_ACTIONS:
+        raise ReplayError(f"Version {entry['version']} replaced the state; replay from its snapshot")
+    if game_state.version != entry['version'] - 1:
+        raise ReplayError(f"Entry for version {entry['version']} doesn't follow version {game_state.version}")
+
+    now = entry['time']
+    rng = engine.transition_rng(game_state)
+    engine.advance(game_state, now, rng)
+    if entry['action'] is not None:
+        engine.run_action(game_state, entry['action'], now, rng, *entry['args'])
+    game_state.version = entry['version']
+
+    # The live game stores every version and loads it afresh, so round-trip
+    # here too: derived data is rebuilt exactly as it would have been
+    return engine.restore_state(game_state.to_dict())
+
+
+def replay(snapshot, entries, version=None):
+    """The state at `version` (default: the last entry) from a snapshot dict and the entries after it"""
+    game_state = engine.restore_state(snapshot)
+    for entry in entries:
+        if version is not None and entry['version'] > version:
+            break
+        if entry['version'] <= game_state.version:
+            continue
+        game_state = apply_entry(game_state, entry)
+    if version is not None and game_state.version != version:
+        raise ReplayError(f'Version {version} is not in the history')
+    return game_state
+
+
+class ActionLog:
+    """Buffers entries and snapshots and writes them from a background thread
+
+    Backends implement _write(), _read() and _compact().
+    """
+
+    def __init__(self, snapshot_interval=100, retention=3, flush_interval=1.0, compact_interval=300.0):
+        self.snapshot_interval = snapshot_interval
+        self.retention = retention
+        self._pending_entries = []      # (player id, entry)
+        self._pending_snapshots = []    # (player id, version, encoded state)
+        self._lock = threading.Lock()
+        # Serializes batches, so a flush never overtakes an earlier one
+        self._write_lock = threading.Lock()
+
+        self._stopped = threading.Event()
+        self._writer = None
+        if flush_interval:
+            self._writer = threading.Thread(target=self._write_periodically,
+                                            args=(flush_interval, compact_interval),
+                                            name='action-log-writer', daemon=True)
+            self._writer.start()
+
+    def record(self, player_id, game_state, now, action=None, args=()):
+        """Log a saved change; `game_state` is the dict form of the state it produced"""
+        version = game_state['version']
+        entry = {'version': version, 'time': now, 'action': action, 'args': list(args)}
+        snapshot = action in REPLACING_ACTIONS or version % self.snapshot_interval == 0
+        with self._lock:
+            self._pending_entries.append((player_id, entry))
+            if snapshot:
+                self._pending_snapshots.append((player_id, version, encode_state(game_state, compress=True)))
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                entries, self._pending_entries = self._pending_entries, []
+                snapshots, self._pending_snapshots = self._pending_snapshots, []
+            if entries or snapshots:
+                self._write(entries, snapshots)
+
+    def history(self, player_id, version=None):
+        """The latest snapshot at or before `version` (a state dict) and the entries after it
+
+        Returns (None, []) when the player has no snapshot in range.
+        """
+        self.flush()
+        _, data, entries = self._read(player_id, version)
+        if data is None:
+            return None, []
+        return decode_state(data), entries
+
+    def replay(self, player_id, version=None):
+        """Rebuild the player's state at `version` (default: the latest logged)"""
+        snapshot, entries = self.history(player_id, version)
+        if snapshot is None:
+            raise ReplayError(f'No snapshot of {player_id} to replay from')
+        return replay(snapshot, entries, version)
+
+    def compact(self):
+        self.flush()
+        self._compact()
+
+    def _write_periodically(self, flush_interval, compact_interval):
+        rounds_per_compaction = max(int(compact_interval / flush_interval), 1)
+        rounds = 0
+        while not self._stopped.wait(flush_interval):
+            rounds += 1
+            try:
+                if rounds % rounds_per_compaction == 0:
+                    self.compact()
+                else:
+                    self.flush()
+            except Exception:
+                # Still buffered (or still there to compact); the next round retries
+                pass
+
+    def close(self):
+        self._stopped.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
+
+
+class MemoryActionLog(ActionLog):
+    """Keeps the history in process memory, next to a memory:// store"""
+
+    def __init__(self, **options):
+        self._entries = defaultdict(list)     # player id -> entries by version
+        self._snapshots = defaultdict(list)   # player id -> (version, encoded state) by version
+        self._data_lock = threading.Lock()
+        super().__init__(**options)
+
+    def _write(self, entries, snapshots):
+        with self._data_lock:
+            for player_id, entry in entries:
+                self._entries[player_id].append(entry)
+            for player_id, version, data in snapshots:
+                self._snapshots[player_id].append((version, data))
+
+    def _read(self, player_id, version):
+        with self._data_lock:
+            snapshots = [s for s in self._snapshots.get(player_id, ()) if version is None or s[0] <= version]
+            if not snapshots:
+                return None, None, []
+            snapshot_version, data = snapshots[-1]
+            entries = [e for e in self._entries.get(player_id, ())
+                       if e['version'] > snapshot_version and (version is None or e['version'] <= version)]
+        return snapshot_version, data, entries
+
+    def _compact(self):
+        with self._data_lock:
+            for player_id, snapshots in self._snapshots.items():
+                del snapshots[:-self.retention]
+                oldest = snapshots[0][0]
+                entries = self._entries.get(player_id)
+                if entries:
+                    self._entries[player_id] = [e for e in entries if e['version'] > oldest]
+
+
+class SQLiteActionLog(ActionLog):
+    """History in SQLite; by default in the same file as a sqlite:/// store"""
+
+    def __init__(self, path, **options):
+        self.path = path
+        self._local = connection_local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS action_log ('
+            ' player_id TEXT NOT NULL,'
+            ' version INTEGER NOT NULL,'
+            ' time REAL NOT NULL,'
+            ' action TEXT,'
+            ' args TEXT NOT NULL,'
+            ' PRIMARY KEY (player_id, version)) WITHOUT ROWID'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS action_snapshots ('
+            ' player_id TEXT NOT NULL,'
+            ' version INTEGER NOT NULL,'
+            ' state BLOB NOT NULL,'
+            ' PRIMARY KEY (player_id, version))'
+        )
+        conn.commit()
+        super().__init__(**options)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _write(self, entries, snapshots):
+        # One transaction per batch
+        conn = self._connect()
+        conn.executemany(
+            'INSERT OR REPLACE INTO action_log (player_id, version, time, action, args) VALUES (?, ?, ?, ?, ?)',
+            [(player_id, e['version'], e['time'], e['action'], json.dumps(e['args'])) for player_id, e in entries]
+        )
+        conn.executemany('INSERT OR REPLACE INTO action_snapshots (player_id, version, state) VALUES (?, ?, ?)',
+                         snapshots)
+        conn.commit()
+
+    def _read(self, player_id, version):
+        conn = self._connect()
+        limit = version if version is not None else 2 ** 63 - 1
+        row = conn.execute(
+            'SELECT version, state FROM action_snapshots WHERE player_id = ? AND version <= ? '
+            'ORDER BY version DESC LIMIT 1',
+            (player_id, limit)
+        ).fetchone()
+        if row is None:
+            return None, None, []
+        rows = conn.execute(
+            'SELECT version, time, action, args FROM action_log '
+            'WHERE player_id = ? AND version > ? AND version <= ? ORDER BY version',
+            (player_id, row[0], limit)
+        ).fetchall()
+        entries = [{'version': v, 'time': t, 'action': a, 'args': json.loads(args)} for v, t, a, args in rows]
+        return row[0], row[1], entries
+
+    def _compact(self):
+        conn = self._connect()
+        conn.execute(
+            'DELETE FROM action_snapshots WHERE (player_id, version) IN ('
+            ' SELECT player_id, version FROM ('
+            '  SELECT player_id, version,'
+            '   ROW_NUMBER() OVER (PARTITION BY player_id ORDER BY version DESC) AS newer'
+            '  FROM action_snapshots)'
+            ' WHERE newer > ?)',
+            (self.retention,)
+        )
+        conn.execute(
+            'DELETE FROM action_log WHERE version <= ('
+            ' SELECT MIN(version) FROM action_snapshots s WHERE s.player_id = action_log.player_id)'
+        )
+        conn.commit()
+
+    def close(self):
+        super().close()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_action_log(url, **options):
+    """Build an action log from a store-style URL: 'memory://' or 'sqlite:///path/to.db'"""
+    if url == 'memory://':
+        return MemoryActionLog(**options)
+    if url.startswith('sqlite:///'):
+        return SQLiteActionLog(url[len('sqlite:///'):], **options)
+    raise ValueError(f'Unsupported action log: {url}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay or export a player's logged history")
+    parser.add_argument('log', help="the action log's URL, e.g. sqlite:///code_empire.db")
+    parser.add_argument('player_id')
+    parser.add_argument('--version', type=int, default=None, help='defaults to the latest logged')
+    parser.add_argument('--export', action='store_true',
+                        help='print the snapshot and entries instead of the replayed state')
+    args = parser.parse_args()
+
+    action_log = create_action_log(args.log, flush_interval=0)
+    snapshot, entries = action_log.history(args.player_id, args.version)
+    if snapshot is None:
+        parser.exit(1, f'No snapshot of {args.player_id} in the log\n')
+    if args.export:
+        print(json.dumps({'snapshot': snapshot, 'entries': entries}))
+    else:
+        print(json.dumps(replay(snapshot, entries, args.version).to_dict(), indent=2))
+    action_log.close()
@@ -0,0 +1,777 @@
+import hashlib
+import json
+
+from pricing import build_cost_tables, cumulative_factors
+
+# Game constants - significantly increased difficulty
+CLICK_BASE_VALUE = 1
+UPGRADE_MULTIPLIER = 1.15  # Reduced from 1.5 for more gradual scaling with many more levels
+PASSIVE_INCOME_INTERVAL = 1  # seconds
+PRESTIGE_REQUIREMENT = 1_000_000_000  # Increased to 1 billion lines
+PRESTIGE_BONUS_RATE = 0.1  # prestige multiplier gained per PRESTIGE_REQUIREMENT lines
+MAX_UPGRADE_LEVEL = 1000  # New default max level for most upgrades
+MAX_ASSET_LEVEL = 500  # New default max level for most assets
+MAX_CLICK_BATCH_WINDOW = 10  # seconds of buffered clicks accepted by /click_batch
+MAX_CLICKS_PER_SECOND = 50  # upper bound on believable click rates
+EVENT_MEAN_INTERVAL = 300  # mean seconds between special events (Poisson arrivals)
+EVENT_IDLE_AFTER = 300  # seconds without an action after which no new events start
+OFFLINE_THRESHOLD = 60  # seconds away before passive catch-up is reported to the player
+
+# Extended list of upgrades with vastly increased costs and progression curve
+UPGRADES = {
+    # TIER 1: Basic Tools (0-1k lines) - Early Game
+    'notepad': {
+        'name': 'Notepad',
+        'description': 'The most basic text editor',
+        'base_cost': 10,
+        'click_bonus': 0.2,
+        'icon': 'notepad.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 1
+    },
+    'better_keyboard': {
+        'name': 'Better Keyboard',
+        'description': 'Type faster with a mechanical keyboard',
+        'base_cost': 50,
+        'click_bonus': 0.5,
+        'icon': 'keyboard.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 1
+    },
+    'syntax_highlighting': {
+        'name': 'Syntax Highlighting',
+        'description': 'Colors make code more readable',
+        'base_cost': 200,
+        'click_bonus': 1,
+        'icon': 'syntax.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 1
+    },
+    'code_snippets': {
+        'name': 'Code Snippets',
+        'description': 'Reuse common code patterns',
+        'base_cost': 500,
+        'click_bonus': 2,
+        'icon': 'snippet.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 1
+    },
+    'autocomplete': {
+        'name': 'Auto-Complete',
+        'description': 'Suggestions as you type',
+        'base_cost': 1_000,
+        'click_bonus': 3,
+        'icon': 'autocomplete.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 1
+    },
+    
+    # TIER 2: IDE Features (1k-10k lines) - Early-Mid Game
+    'error_detection': {
+        'name': 'Error Detection',
+        'description': 'Find errors before running the code',
+        'base_cost': 2_500,
+        'click_bonus': 5,
+        'icon': 'error.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 2
+    },
+    'ide_plugins': {
+        'name': 'IDE Plugins',
+        'description': 'Enhance productivity with plugins',
+        'base_cost': 5_000,
+        'click_bonus': 10,
+        'icon': 'plugin.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 2
+    },
+    'version_control': {
+        'name': 'Version Control',
+        'description': 'Track changes in your code',
+        'base_cost': 10_000,
+        'click_bonus': 15,
+        'icon': 'git.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 2
+    },
+    'linter': {
+        'name': 'Code Linter',
+        'description': 'Automatically fix code style issues',
+        'base_cost': 25_000,
+        'click_bonus': 25,
+        'icon': 'linter.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 2
+    },
+    'debugger': {
+        'name': 'Debugger',
+        'description': 'Step through code to find bugs',
+        'base_cost': 50_000,
+        'click_bonus': 40,
+        'icon': 'debug.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 2
+    },
+    
+    # TIER 3: Professional Tools (10k-100k lines) - Mid Game
+    'code_formatter': {
+        'name': 'Code Formatter',
+        'description': 'Maintain consistent code style',
+        'base_cost': 100_000,
+        'click_bonus': 60,
+        'icon': 'format.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 3
+    },
+    'test_framework': {
+        'name': 'Test Framework',
+        'description': 'Automate code testing',
+        'base_cost': 250_000,
+        'click_bonus': 80,
+        'icon': 'test.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 3
+    },
+    'pair_programming': {
+        'name': 'Pair Programming',
+        'description': 'Two programmers, one keyboard',
+        'base_cost': 500_000,
+        'click_bonus': 120,
+        'icon': 'pair.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 3
+    },
+    'code_review_tools': {
+        'name': 'Code Review Tools',
+        'description': 'Improve code quality with peer feedback',
+        'base_cost': 1_000_000,
+        'click_bonus': 200,
+        'icon': 'review.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 3
+    },
+    'continuous_integration': {
+        'name': 'Continuous Integration',
+        'description': 'Automatically build and test code',
+        'base_cost': 2_500_000,
+        'click_bonus': 350,
+        'icon': 'ci.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 3
+    },
+    
+    # TIER 4: Advanced Technologies (100k-1M lines) - Mid-Late Game
+    'ai_assistant': {
+        'name': 'AI Assistant',
+        'description': 'Get coding help from AI',
+        'base_cost': 5_000_000,
+        'click_bonus': 500,
+        'icon': 'ai.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 4
+    },
+    'code_generation': {
+        'name': 'Code Generation',
+        'description': 'Generate boilerplate code automatically',
+        'base_cost': 10_000_000,
+        'click_bonus': 800,
+        'icon': 'generate.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 4
+    },
+    'smart_refactoring': {
+        'name': 'Smart Refactoring',
+        'description': 'AI-assisted code restructuring',
+        'base_cost': 25_000_000,
+        'click_bonus': 1_200,
+        'icon': 'refactor-smart.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 4
+    },
+    'adaptive_compiler': {
+        'name': 'Adaptive Compiler',
+        'description': 'Compiler that learns your coding patterns',
+        'base_cost': 50_000_000,
+        'click_bonus': 2_000,
+        'icon': 'compiler.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 4
+    },
+    'neural_optimizer': {
+        'name': 'Neural Code Optimizer',
+        'description': 'Neural network optimization of your code',
+        'base_cost': 100_000_000,
+        'click_bonus': 3_500,
+        'icon': 'optimizer.png',
+        'max_level': MAX_UPGRADE_LEVEL,
+        'tier': 4
+    },
+    
+    # TIER 5: Future Tech (1M-100M lines) - Late Game
+    'quantum_keyboard': {
+        'name': 'Quantum Keyboard',
+        'description': 'Type in multiple universes simultaneously',
+        'base_cost': 250_000_000,
+        'click_bonus': 5_000,
+        'icon': 'quantum.png',
+        'max_level': 500,
+        'tier': 5
+    },
+    'thought_interface': {
+        'name': 'Thought Interface',
+        'description': 'Code directly from your thoughts',
+        'base_cost': 500_000_000,
+        'click_bonus': 8_000,
+        'icon': 'thought.png',
+        'max_level': 500,
+        'tier': 5
+    },
+    'automatic_refactoring': {
+        'name': 'Automatic Refactoring',
+        'description': 'Your code refactors itself for better efficiency',
+        'base_cost': 1_000_000_000,
+        'click_bonus': 15_000,
+        'icon': 'refactor.png',
+        'max_level': 500,
+        'tier': 5
+    },
+    'holographic_interface': {
+        'name': 'Holographic Interface',
+        'description': 'Manipulate code in 3D space',
+        'base_cost': 5_000_000_000,
+        'click_bonus': 30_000,
+        'icon': 'hologram.png',
+        'max_level': 300,
+        'tier': 5
+    },
+    
+    # TIER 6: Sci-Fi Tech (100M-10B lines) - End Game
+    'time_manipulation_ide': {
+        'name': 'Time-Manipulation IDE',
+        'description': 'Slow down time to code faster than humanly possible',
+        'base_cost': 10_000_000_000,
+        'click_bonus': 50_000,
+        'icon': 'time.png',
+        'max_level': 200,
+        'tier': 6
+    },
+    'quantum_computing': {
+        'name': 'Quantum Computing',
+        'description': 'Harness quantum superposition for coding',
+        'base_cost': 50_000_000_000,
+        'click_bonus': 100_000,
+        'icon': 'quantum-computer.png',
+        'max_level': 200,
+        'tier': 6
+    },
+    'consciousness_upload': {
+        'name': 'Consciousness Upload',
+        'description': 'Become one with your code',
+        'base_cost': 100_000_000_000,
+        'click_bonus': 250_000,
+        'icon': 'upload.png',
+        'max_level': 150,
+        'tier': 6
+    },
+    'reality_compiler': {
+        'name': 'Reality Compiler',
+        'description': 'Your code directly alters reality',
+        'base_cost': 500_000_000_000,
+        'click_bonus': 500_000,
+        'icon': 'reality.png',
+        'max_level': 100,
+        'tier': 6
+    },
+    'universal_programmer': {
+        'name': 'Universal Programmer',
+        'description': 'Program the fundamental laws of the universe',
+        'base_cost': 1_000_000_000_000,
+        'click_bonus': 1_000_000,
+        'icon': 'universe.png',
+        'max_level': 10,
+        'tier': 6
+    }
+}
+
+# Extended list of passive assets with increased costs and progression curve
+PASSIVE_ASSETS = {
+    # TIER 1: Basic Staff (0-1k lines) - Early Game
+    'intern': {
+        'name': 'Intern',
+        'description': 'Hires a coding intern',
+        'base_cost': 100,
+        'income': 0.1,
+        'icon': 'intern.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 1
+    },
+    'student_coder': {
+        'name': 'Student Coder',
+        'description': 'Part-time student looking for experience',
+        'base_cost': 250,
+        'income': 0.3,
+        'icon': 'student.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 1
+    },
+    'code_bootcamp_grad': {
+        'name': 'Bootcamp Graduate',
+        'description': 'Recently completed a coding bootcamp',
+        'base_cost': 500,
+        'income': 0.6,
+        'icon': 'bootcamp.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 1
+    },
+    'junior_dev': {
+        'name': 'Junior Developer',
+        'description': 'Hires a junior programmer',
+        'base_cost': 1_000,
+        'income': 1.2,
+        'icon': 'junior.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 1
+    },
+    
+    # TIER 2: Professional Staff (1k-10k lines) - Early-Mid Game
+    'mid_level_dev': {
+        'name': 'Mid-Level Developer',
+        'description': 'Developer with a few years of experience',
+        'base_cost': 2_500,
+        'income': 2.5,
+        'icon': 'mid.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 2
+    },
+    'qa_engineer': {
+        'name': 'QA Engineer',
+        'description': 'Finds and fixes bugs before they cause problems',
+        'base_cost': 5_000,
+        'income': 4,
+        'icon': 'qa.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 2
+    },
+    'devops_specialist': {
+        'name': 'DevOps Specialist',
+        'description': 'Streamlines your development pipeline',
+        'base_cost': 10_000,
+        'income': 7,
+        'icon': 'devops.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 2
+    },
+    'senior_dev': {
+        'name': 'Senior Developer',
+        'description': 'Hires an experienced programmer',
+        'base_cost': 25_000,
+        'income': 12,
+        'icon': 'senior.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 2
+    },
+    
+    # TIER 3: Team Structure (10k-100k lines) - Mid Game
+    'frontend_team': {
+        'name': 'Frontend Team',
+        'description': 'Specialized in user interfaces',
+        'base_cost': 50_000,
+        'income': 20,
+        'icon': 'frontend.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 3
+    },
+    'backend_team': {
+        'name': 'Backend Team',
+        'description': 'Specialized in server-side code',
+        'base_cost': 100_000,
+        'income': 35,
+        'icon': 'backend.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 3
+    },
+    'mobile_team': {
+        'name': 'Mobile Dev Team',
+        'description': 'Specialized in mobile applications',
+        'base_cost': 250_000,
+        'income': 60,
+        'icon': 'mobile.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 3
+    },
+    'dev_team': {
+        'name': 'Full Dev Team',
+        'description': 'Hires a whole team of developers',
+        'base_cost': 500_000,
+        'income': 100,
+        'icon': 'team.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 3
+    },
+    
+    # TIER 4: Organization Structure (100k-1M lines) - Mid-Late Game
+    'development_department': {
+        'name': 'Development Department',
+        'description': 'A full department dedicated to coding',
+        'base_cost': 1_000_000,
+        'income': 175,
+        'icon': 'department.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 4
+    },
+    'research_division': {
+        'name': 'R&D Division',
+        'description': 'Pushing the boundaries of what\'s possible',
+        'base_cost': 2_500_000,
+        'income': 300,
+        'icon': 'research.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 4
+    },
+    'ai_tools_division': {
+        'name': 'AI Tools Division',
+        'description': 'Creating AI-powered development tools',
+        'base_cost': 5_000_000,
+        'income': 500,
+        'icon': 'ai-tools.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 4
+    },
+    'ai_cluster': {
+        'name': 'AI Code Cluster',
+        'description': 'Deploys AI to write code continuously',
+        'base_cost': 10_000_000,
+        'income': 800,
+        'icon': 'cluster.png',
+        'max_level': MAX_ASSET_LEVEL,
+        'tier': 4
+    },
+    
+    # TIER 5: Future Tech Teams (1M-100M lines) - Late Game
+    'quantum_team': {
+        'name': 'Quantum Programming Team',
+        'description': 'Specializes in quantum algorithms',
+        'base_cost': 25_000_000,
+        'income': 1_500,
+        'icon': 'quantum-team.png',
+        'max_level': 300,
+        'tier': 5
+    },
+    'neural_interface_lab': {
+        'name': 'Neural Interface Lab',
+        'description': 'Developing direct brain-to-code interfaces',
+        'base_cost': 50_000_000,
+        'income': 3_000,
+        'icon': 'neural-lab.png',
+        'max_level': 300,
+        'tier': 5
+    },
+    'quantum_server': {
+        'name': 'Quantum Server Farm',
+        'description': 'Computes code in parallel universes',
+        'base_cost': 100_000_000,
+        'income': 5_000,
+        'icon': 'quantum-server.png',
+        'max_level': 250,
+        'tier': 5
+    },
+    
+    # TIER 6: Sci-Fi Organizations (100M-10B lines) - End Game
+    'code_generators': {
+        'name': 'Neural Code Generators',
+        'description': 'Advanced neural networks that generate entire codebases',
+        'base_cost': 250_000_000,
+        'income': 10_000,
+        'icon': 'neural.png',
+        'max_level': 200,
+        'tier': 6
+    },
+    'sentient_code_colony': {
+        'name': 'Sentient Code Colony',
+        'description': 'Self-aware code that writes more of itself',
+        'base_cost': 500_000_000,
+        'income': 20_000,
+        'icon': 'sentient.png',
+        'max_level': 150,
+        'tier': 6
+    },
+    'time_loop_systems': {
+        'name': 'Time Loop Systems',
+        'description': 'Code written in the future sent back to now',
+        'base_cost': 1_000_000_000,
+        'income': 40_000,
+        'icon': 'timeloop.png',
+        'max_level': 100,
+        'tier': 6
+    },
+    'multiverse_coding_network': {
+        'name': 'Multiverse Coding Network',
+        'description': 'Collaborative coding across parallel universes',
+        'base_cost': 5_000_000_000,
+        'income': 100_000,
+        'icon': 'multiverse.png',
+        'max_level': 50,
+        'tier': 6
+    },
+    'cosmic_code_entity': {
+        'name': 'Cosmic Code Entity',
+        'description': 'A being of pure code extending across space-time',
+        'base_cost': 10_000_000_000,
+        'income': 250_000,
+        'icon': 'cosmic.png',
+        'max_level': 10,
+        'tier': 6
+    }
+}
+
+# Lines of code at which each tier's upgrades and assets come into reach
+TIER_THRESHOLDS = {
+    1: 0,
+    2: 1_000,
+    3: 10_000,
+    4: 100_000,
+    5: 1_000_000,
+    6: 100_000_000
+}
+
+# Revamped themes with vastly increased thresholds
+THEMES = {
+    0: {
+        'name': 'Notepad',
+        'description': 'Basic text editor',
+        'css': 'notepad.css'
+    },
+    10_000: {
+        'name': 'Terminal',
+        'description': 'Command line interface',
+        'css': 'terminal.css'
+    },
+    1_000_000: {
+        'name': 'IDE Basic',
+        'description': 'Simple integrated development environment',
+        'css': 'ide_basic.css'
+    },
+    100_000_000: {
+        'name': 'Modern IDE',
+        'description': 'Professional development environment',
+        'css': 'modern_ide.css'
+    },
+    10_000_000_000: {
+        'name': 'Futuristic Interface',
+        'description': 'Next-gen programming interface',
+        'css': 'futuristic.css'
+    },
+    1_000_000_000_000: {
+        'name': 'Virtual Holographic',
+        'description': 'Holographic programming experience',
+        'css': 'holographic.css'
+    }
+}
+
+# Requirements are (field, comparator, threshold) conditions on the game state;
+# a list of conditions must all hold. Dotted fields reach into nested dicts.
+ACHIEVEMENTS = {
+    'first_line': {
+        'name': 'Hello World',
+        'description': 'Write your first line of code',
+        'icon': 'achievement_first.png',
+        'requirement': ('lines_of_code', '>=', 1),
+        'reward': None
+    },
+    'hundred_lines': {
+        'name': 'Code Apprentice',
+        'description': 'Write 100 lines of code',
+        'icon': 'achievement_100.png',
+        'requirement': ('lines_of_code', '>=', 100),
+        'reward': {'click_bonus': 1}
+    },
+    'thousand_lines': {
+        'name': 'Code Journeyman',
+        'description': 'Write 1,000 lines of code',
+        'icon': 'achievement_1k.png',
+        'requirement': ('lines_of_code', '>=', 1_000),
+        'reward': {'click_bonus': 5}
+    },
+    'million_lines': {
+        'name': 'Code Master',
+        'description': 'Write 1,000,000 lines of code',
+        'icon': 'achievement_1m.png',
+        'requirement': ('lines_of_code', '>=', 1_000_000),
+        'reward': {'click_bonus': 100}
+    },
+    'first_upgrade': {
+        'name': 'Tooling Up',
+        'description': 'Purchase your first upgrade',
+        'icon': 'achievement_upgrade.png',
+        'requirement': ('stats.upgrades_purchased', '>=', 1),
+        'reward': None
+    },
+    'all_basic_upgrades': {
+        'name': 'Well-Equipped',
+        'description': 'Get at least one level in each basic upgrade',
+        'icon': 'achievement_all_upgrades.png',
+        'requirement': [('upgrades.better_keyboard', '>', 0), ('upgrades.code_snippets', '>', 0), ('upgrades.ide_plugins', '>', 0)],
+        'reward': {'passive_bonus': 0.5}
+    },
+    'max_upgrade': {
+        'name': 'Maximized Efficiency',
+        'description': 'Max out any upgrade',
+        'icon': 'achievement_max.png',
+        'requirement': ('stats.upgrades_maxed', '>=', 1),
+        'reward': {'click_bonus': 50}
+    },
+    'first_asset': {
+        'name': 'Team Builder',
+        'description': 'Hire your first team member',
+        'icon': 'achievement_team.png',
+        'requirement': ('stats.assets_purchased', '>=', 1),
+        'reward': None
+    },
+    'all_basic_assets': {
+        'name': 'Full Squad',
+        'description': 'Hire at least one of each basic asset',
+        'icon': 'achievement_all_assets.png',
+        'requirement': [('passive_assets.intern', '>', 0), ('passive_assets.junior_dev', '>', 0), ('passive_assets.senior_dev', '>', 0)],
+        'reward': {'click_bonus': 10}
+    },
+    'max_asset': {
+        'name': 'HR Master',
+        'description': 'Max out any passive asset',
+        'icon': 'achievement_max_asset.png',
+        'requirement': ('stats.assets_maxed', '>=', 1),
+        'reward': {'passive_multiplier': 1.5}
+    },
+    'first_prestige': {
+        'name': 'Reborn Coder',
+        'description': 'Prestige for the first time',
+        'icon': 'achievement_prestige.png',
+        'requirement': ('prestige_level', '>=', 1),
+        'reward': {'prestige_bonus': 0.1}
+    },
+    'five_prestiges': {
+        'name': 'Code Immortal',
+        'description': 'Prestige five times',
+        'icon': 'achievement_prestige5.png',
+        'requirement': ('prestige_level', '>=', 5),
+        'reward': {'prestige_bonus': 0.5}
+    },
+    'speed_demon': {
+        'name': 'Speed Demon',
+        'description': 'Reach 1,000 lines per click',
+        'icon': 'achievement_speed.png',
+        'requirement': ('code_per_click', '>=', 1_000),
+        'reward': {'click_multiplier': 1.25}
+    },
+    'passive_master': {
+        'name': 'Passive Income Master',
+        'description': 'Reach 1,000 lines per second',
+        'icon': 'achievement_passive.png',
+        'requirement': ('code_per_second', '>=', 1_000),
+        'reward': {'passive_multiplier': 2}
+    },
+    'keyboard_warrior': {
+        'name': 'Keyboard Warrior',
+        'description': 'Click 1,000 times',
+        'icon': 'achievement_clicks.png',
+        'requirement': ('total_clicks', '>=', 1_000),
+        'reward': {'click_multiplier': 1.1}
+    },
+    'overnight_coder': {
+        'name': 'Overnight Coder',
+        'description': 'Let passive income generate for at least 8 hours',
+        'icon': 'achievement_overnight.png',
+        'requirement': ('longest_session', '>=', 8 * 3600),
+        'reward': {'passive_multiplier': 1.2}
+    }
+}
+
+# weight: relative chance of being the event that arrives
+# cooldown: seconds after it starts before the same event can arrive again
+SPECIAL_EVENTS = {
+    'bug_found': {
+        'name': 'Bug Found!',
+        'description': 'A critical bug was found in your code. Fix it quickly!',
+        'action': 'Click rapidly to fix',
+        'reward': {'temporary_click_multiplier': 5, 'duration': 10},
+        'failure': {'lines_penalty': 0.05},
+        'weight': 3,
+        'cooldown': 120
+    },
+    'code_review': {
+        'name': 'Code Review',
+        'description': 'Your code is being reviewed. Make improvements to impress your peers.',
+        'action': 'Purchase an upgrade',
+        'reward': {'lines_bonus': 0.2, 'duration': 30},
+        'failure': {'production_penalty': 0.5, 'duration': 20},
+        'weight': 2,
+        'cooldown': 300
+    },
+    'hackathon': {
+        'name': 'Hackathon',
+        'description': 'A coding hackathon is happening! Show off your skills!',
+        'action': 'Reach target lines in time',
+        'target_multiplier': 1.2,  # of the lines of code when it starts
+        'time_limit': 60,
+        'reward': {'new_upgrade_unlock': 'hackathon_trophy'},
+        'failure': None,
+        'weight': 1,
+        'cooldown': 1800
+    }
+}
+
+def build_milestones():
+    """Theme, tier and line-count achievement thresholds in one list, by lines
+
+    Each milestone is {'lines', 'kind', 'id', 'name'}; it is reached once
+    lines_of_code is at least its lines, so the milestones reached are the
+    prefix found with bisect_right over the lines.
+    """
+    milestones = [
+        {'lines': threshold, 'kind': 'theme', 'id': theme['css'], 'name': theme['name']}
+        for threshold, theme in THEMES.items()
+    ]
+    milestones.extend(
+        {'lines': threshold, 'kind': 'tier', 'id': tier, 'name': f'Tier {tier}'}
+        for tier, threshold in TIER_THRESHOLDS.items()
+    )
+    for achievement_id, achievement in ACHIEVEMENTS.items():
+        requirement = achievement['requirement']
+        if isinstance(requirement, tuple) and requirement[:2] == ('lines_of_code', '>='):
+            milestones.append({'lines': requirement[2], 'kind': 'achievement', 'id': achievement_id,
+                               'name': achievement['name']})
+    kinds = ('theme', 'tier', 'achievement')
+    milestones.sort(key=lambda m: (m['lines'], kinds.index(m['kind'])))
+    return milestones
+
+def build_catalog():
+    """Everything the client needs that doesn't depend on the player"""
+    return {
+        'upgrades': UPGRADES,
+        'passive_assets': PASSIVE_ASSETS,
+        'themes': THEMES,
+        'achievements': {
+            achievement_id: {k: v for k, v in achievement.items() if k != 'requirement'}
+            for achievement_id, achievement in ACHIEVEMENTS.items()
+        },
+        'upgrade_multiplier': UPGRADE_MULTIPLIER,
+        'prestige_requirement': PRESTIGE_REQUIREMENT,
+        'prestige_bonus_rate': PRESTIGE_BONUS_RATE,
+        'milestones': MILESTONES,
+        # One table serves every item: prices only differ by base_cost
+        'cumulative_cost_factors': cumulative_factors(UPGRADE_MULTIPLIER, max(
+            item['max_level'] for item in (*UPGRADES.values(), *PASSIVE_ASSETS.values())
+        ))
+    }
+
+MILESTONES = build_milestones()
+MILESTONE_LINES = [milestone['lines'] for milestone in MILESTONES]
+THEME_THRESHOLDS = sorted(THEMES)
+THEME_CSS = [THEMES[threshold]['css'] for threshold in THEME_THRESHOLDS]
+
+# Price curves are fixed by the catalog, so they are tabulated once at startup
+UPGRADE_COSTS = build_cost_tables(UPGRADES, UPGRADE_MULTIPLIER)
+ASSET_COSTS = build_cost_tables(PASSIVE_ASSETS, UPGRADE_MULTIPLIER)
+
+# Serialized once; the hash in the URL changes whenever the catalog does
+CATALOG_JSON = json.dumps(build_catalog(), sort_keys=True, separators=(',', ':'))
+CATALOG_HASH = hashlib.sha256(CATALOG_JSON.encode()).hexdigest()[:16]
@@ -0,0 +1,474 @@
+import json
+import re
+import struct
+import zlib
+from operator import itemgetter
+
+# Compact binary encoding of a game state
+#
+#   magic 'CE' | schema version (1 byte) | flags (1 byte) | body (zlib'd if flagged)
+#
+# The body is a presence bitmap (varint) over the schema's fields, the present
+# fields in schema order, then a length-prefixed JSON object with whatever the
+# schema doesn't cover (active events, temporary multipliers, unknown keys).
+# Floats are little-endian doubles, counts are varints, levels are varint
+# arrays and achievements and the theme are indices, all in the frozen catalog
+# numbering below, so decoding is lossless.
+#
+# New fields only ever get appended to a new schema version; old blobs keep
+# decoding with the field list they were written with.
+
+MAGIC = b'CE'
+SCHEMA_VERSION = 1
+FLAG_ZLIB = 1
+
+# States are a few KB at most; a compressed body inflating past this is
+# rejected instead of decompressed (saves are imported from users)
+MAX_STATE_BYTES = 1 << 20
+
+# The numbering of catalog items in blobs. It is frozen rather than taken from
+# catalog.py, so reordering the catalog or inserting an item mid-tier doesn't
+# shift the levels of stored saves: these lists are append-only. An item the
+# catalog has but these lists don't yet is still saved exactly, in the JSON
+# part (the whole level dict goes there), until its id is appended here.
+# Never remove or reorder an id.
+UPGRADE_IDS = (
+    'notepad', 'better_keyboard', 'syntax_highlighting', 'code_snippets', 'autocomplete',
+    'error_detection', 'ide_plugins', 'version_control', 'linter', 'debugger', 'code_formatter',
+    'test_framework', 'pair_programming', 'code_review_tools', 'continuous_integration',
+    'ai_assistant', 'code_generation', 'smart_refactoring', 'adaptive_compiler', 'neural_optimizer',
+    'quantum_keyboard', 'thought_interface', 'automatic_refactoring', 'holographic_interface',
+    'time_manipulation_ide', 'quantum_computing', 'consciousness_upload', 'reality_compiler',
+    'universal_programmer'
+)
+ASSET_IDS = (
+    'intern', 'student_coder', 'code_bootcamp_grad', 'junior_dev', 'mid_level_dev', 'qa_engineer',
+    'devops_specialist', 'senior_dev', 'frontend_team', 'backend_team', 'mobile_team', 'dev_team',
+    'development_department', 'research_division', 'ai_tools_division', 'ai_cluster', 'quantum_team',
+    'neural_interface_lab', 'quantum_server', 'code_generators', 'sentient_code_colony',
+    'time_loop_systems', 'multiverse_coding_network', 'cosmic_code_entity'
+)
+ACHIEVEMENT_IDS = (
+    'first_line', 'hundred_lines', 'thousand_lines', 'million_lines', 'first_upgrade',
+    'all_basic_upgrades', 'max_upgrade', 'first_asset', 'all_basic_assets', 'max_asset',
+    'first_prestige', 'five_prestiges', 'speed_demon', 'passive_master', 'keyboard_warrior',
+    'overnight_coder'
+)
+THEME_CSS = (
+    'notepad.css', 'terminal.css', 'ide_basic.css', 'modern_ide.css', 'futuristic.css',
+    'holographic.css'
+)
+ACHIEVEMENT_NUMBERS = {achievement_id: index for index, achievement_id in enumerate(ACHIEVEMENT_IDS)}
+THEME_NUMBERS = {css: index for index, css in enumerate(THEME_CSS)}
+
+# (dotted path, kind); kinds: f = double, u = unsigned varint,
+# upgrades/assets = level arrays, achievements = id list, theme = css name.
+# Fields are grouped by kind so a complete state encodes in a few bulk steps.
+FIELDS_V1 = (
+    ('lines_of_code', 'f'),
+    ('prestige_multiplier', 'f'),
+    ('code_per_click', 'f'),
+    ('code_per_second', 'f'),
+    ('last_tick', 'f'),
+    ('longest_session', 'f'),
+    ('last_session_start', 'f'),
+    ('next_event_roll', 'f'),
+    ('production.click_base', 'f'),
+    ('production.click_flat', 'f'),
+    ('production.click_multiplier', 'f'),
+    ('production.passive_base', 'f'),
+    ('production.passive_flat', 'f'),
+    ('production.passive_multiplier', 'f'),
+    ('stats.total_lines_written', 'f'),
+    ('stats.total_lines_from_clicks', 'f'),
+    ('stats.total_lines_from_passive', 'f'),
+    ('stats.highest_lines_per_click', 'f'),
+    ('stats.highest_lines_per_second', 'f'),
+    ('prestige_level', 'u'),
+    ('total_clicks', 'u'),
+    ('version', 'u'),
+    ('stats.total_prestiges', 'u'),
+    ('stats.upgrades_purchased', 'u'),
+    ('stats.assets_purchased', 'u'),
+    ('stats.upgrades_maxed', 'u'),
+    ('stats.assets_maxed', 'u'),
+    ('stats.total_clicks', 'u'),
+    ('upgrades', 'upgrades'),
+    ('passive_assets', 'assets'),
+    ('achievements', 'achievements'),
+    ('theme', 'theme')
+)
+
+DOUBLE = struct.Struct('<d')
+
+
+class CodecError(ValueError):
+    """The bytes are not a state this codec can read"""
+
+
+def container_groups(paths):
+    """(container, names, start, end) runs of adjacent paths sharing a container"""
+    groups = []
+    for index, path in enumerate(paths):
+        key, _, sub_key = path.partition('.')
+        container = key if sub_key else None
+        if groups and groups[-1][0] == container:
+            groups[-1][1].append(sub_key or key)
+            groups[-1][3] = index + 1
+        else:
+            groups.append([container, [sub_key or key], index, index + 1])
+    return groups
+
+
+def grouped_getter(paths):
+    """Read dotted paths from a state with one itemgetter per container"""
+    getters = [(container, itemgetter(*names), len(names))
+               for container, names, _, _ in container_groups(paths)]
+
+    def get(game_state):
+        values = []
+        for container, getter, count in getters:
+            found = getter(game_state[container] if container else game_state)
+            if count == 1:
+                values.append(found)
+            else:
+                values.extend(found)
+        return values
+    return get
+
+
+class Schema:
+    """One version of the field layout, with precomputed bulk encoders"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.complete = (1 << len(fields)) - 1
+        self.doubles = [path for path, kind in fields if kind == 'f']
+        self.counts = [path for path, kind in fields if kind == 'u']
+        self.double_struct = struct.Struct(f'<{len(self.doubles)}d')
+        self.get_doubles = grouped_getter(self.doubles)
+        self.get_counts = grouped_getter(self.counts)
+        self.double_groups = container_groups(self.doubles)
+        self.count_groups = container_groups(self.counts)
+        self.tail_varints = sum(
+            {'upgrades': 1 + len(UPGRADE_IDS), 'assets': 1 + len(ASSET_IDS),
+             'achievements': 1 + len(ACHIEVEMENT_IDS), 'theme': 1}.get(kind, 0)
+            for _, kind in fields
+        )
+
+        # Keys each part of a complete state must have exactly
+        self.top_keys = {path.partition('.')[0] for path, _ in fields}
+        self.nested_keys = {}
+        for path, _ in fields:
+            key, _, sub_key = path.partition('.')
+            if sub_key:
+                self.nested_keys.setdefault(key, set()).add(sub_key)
+
+
+SCHEMAS = {1: Schema(FIELDS_V1)}
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_varint(value):
+    out = bytearray()
+    write_varint(out, value)
+    return bytes(out)
+
+
+# Levels, counts and catalog indices are nearly always below 2**14, i.e. one
+# or two varint bytes; those are encoded and decoded by table lookup
+SMALL_VARINT_LIMIT = 1 << 14
+SMALL_VARINTS = [encode_varint(value) for value in range(SMALL_VARINT_LIMIT)]
+SMALL_VARINT_VALUES = {encoded: value for value, encoded in enumerate(SMALL_VARINTS)}
+VARINT_TOKEN = re.compile(rb'[\x80-\xff]?[\x00-\x7f]')
+
+
+def write_varints(out, values):
+    if values and min(values) >= 0 and max(values) < SMALL_VARINT_LIMIT:
+        out += b''.join([SMALL_VARINTS[value] for value in values])  # TypeError on non-ints
+        return
+    for value in values:
+        if not isinstance(value, int) or value < 0:
+            raise ValueError('Not a count')
+        write_varint(out, value)
+
+
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise CodecError('Truncated varint')
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_varints(data, pos, count):
+    tokens = VARINT_TOKEN.findall(data, pos, pos + 2 * count)[:count]
+    if len(tokens) == count:
+        # findall() skips what doesn't match, such as the first byte of a
+        # three-byte varint: the tokens only count if they run on from pos
+        read = b''.join(tokens)
+        if data[pos:pos + len(read)] == read:
+            return [SMALL_VARINT_VALUES[token] for token in tokens], pos + len(read)
+
+    values = []
+    for _ in range(count):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values, pos
+
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def encodable(kind, value):
+    """Whether `value` round-trips exactly through `kind`"""
+    if kind == 'f':
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == 'u':
+        return is_count(value)
+    if kind in ('upgrades', 'assets'):
+        ids = UPGRADE_IDS if kind == 'upgrades' else ASSET_IDS
+        return (isinstance(value, dict) and len(value) == len(ids)
+                and all(is_count(value.get(item_id)) for item_id in ids))
+    if kind == 'achievements':
+        return isinstance(value, list) and all(a in ACHIEVEMENT_NUMBERS for a in value)
+    if kind == 'theme':
+        return isinstance(value, str) and value in THEME_NUMBERS
+    return False
+
+
+def write_value(out, kind, value):
+    if kind == 'f':
+        out += DOUBLE.pack(value)
+    elif kind == 'u':
+        write_varint(out, value)
+    elif kind in ('upgrades', 'assets'):
+        ids = UPGRADE_IDS if kind == 'upgrades' else ASSET_IDS
+        write_varint(out, len(ids))
+        write_varints(out, [value[item_id] for item_id in ids])
+    elif kind == 'achievements':
+        write_varint(out, len(value))
+        write_varints(out, [ACHIEVEMENT_NUMBERS[a] for a in value])
+    elif kind == 'theme':
+        write_varint(out, THEME_NUMBERS[value])
+
+
+def read_levels(data, pos, ids):
+    count, pos = read_varint(data, pos)
+    levels, pos = read_varints(data, pos, count)
+    # Items added to the catalog since the save start at level 0
+    levels = dict(zip(ids, levels))
+    for item_id in ids[count:]:
+        levels[item_id] = 0
+    return levels, pos
+
+
+def read_value(data, pos, kind):
+    if kind == 'f':
+        if pos + DOUBLE.size > len(data):
+            raise CodecError('Truncated float')
+        return DOUBLE.unpack_from(data, pos)[0], pos + DOUBLE.size
+    if kind == 'u':
+        return read_varint(data, pos)
+    if kind == 'upgrades':
+        return read_levels(data, pos, UPGRADE_IDS)
+    if kind == 'assets':
+        return read_levels(data, pos, ASSET_IDS)
+    if kind == 'achievements':
+        count, pos = read_varint(data, pos)
+        numbers, pos = read_varints(data, pos, count)
+        return [ACHIEVEMENT_IDS[number] for number in numbers], pos
+    if kind == 'theme':
+        number, pos = read_varint(data, pos)
+        return THEME_CSS[number], pos
+    raise CodecError(f'Unknown field kind {kind!r}')
+
+
+def encode_complete(schema, game_state):
+    """Bulk encoding of a state that has every schema field in canonical form
+
+    Raises (KeyError, TypeError, ValueError, struct.error) when it doesn't;
+    encode_state() then falls back to encoding field by field.
+    """
+    body = bytearray()
+    write_varint(body, schema.complete)
+    doubles = schema.get_doubles(game_state)
+    if not all(type(value) in (int, float) for value in doubles):
+        raise TypeError('Not a number')
+    body += schema.double_struct.pack(*doubles)
+
+    upgrades, assets = game_state['upgrades'], game_state['passive_assets']
+    if len(upgrades) != len(UPGRADE_IDS) or len(assets) != len(ASSET_IDS):
+        raise KeyError('Levels off catalog')
+    achievements = game_state['achievements']
+    write_varints(body, [
+        *schema.get_counts(game_state),
+        len(UPGRADE_IDS), *(upgrades[item_id] for item_id in UPGRADE_IDS),
+        len(ASSET_IDS), *(assets[item_id] for item_id in ASSET_IDS),
+        len(achievements), *(ACHIEVEMENT_NUMBERS[a] for a in achievements),
+        THEME_NUMBERS[game_state['theme']]
+    ])
+
+    extras = {key: value for key, value in game_state.items() if key not in schema.top_keys}
+    for key, known in schema.nested_keys.items():
+        nested = game_state[key]
+        if len(nested) != len(known):
+            extras[key] = {k: v for k, v in nested.items() if k not in known}
+    return body, extras
+
+
+def encode_fields(schema, game_state):
+    """Field-by-field encoding for states missing fields or with odd values"""
+    present = 0
+    values = bytearray()
+
+    # Everything the schema handles is taken out of a copy; the rest is JSON
+    extras = {key: dict(value) if isinstance(value, dict) else value for key, value in game_state.items()}
+    for bit, (path, kind) in enumerate(schema.fields):
+        key, _, sub_key = path.partition('.')
+        container = extras if not sub_key else extras.get(key)
+        name = sub_key or key
+        if not isinstance(container, dict) or name not in container:
+            continue
+        if not encodable(kind, container[name]):
+            continue
+        present |= 1 << bit
+        write_value(values, kind, container.pop(name))
+        if sub_key and not container:
+            del extras[key]
+
+    body = bytearray()
+    write_varint(body, present)
+    body += values
+    return body, extras
+
+
+def encode_state(game_state, compress=False):
+    """Serialize a game state dict to bytes"""
+    schema = SCHEMAS[SCHEMA_VERSION]
+    try:
+        body, extras = encode_complete(schema, game_state)
+    except (KeyError, TypeError, ValueError, struct.error):
+        body, extras = encode_fields(schema, game_state)
+
+    extra_json = json.dumps(extras, separators=(',', ':')).encode() if extras else b''
+    write_varint(body, len(extra_json))
+    body += extra_json
+
+    flags = 0
+    if compress:
+        body = zlib.compress(bytes(body))
+        flags |= FLAG_ZLIB
+    return MAGIC + bytes((SCHEMA_VERSION, flags)) + bytes(body)
+
+
+def decode_complete(schema, body, pos):
+    """Bulk decoding of a body written by encode_complete()"""
+    doubles = schema.double_struct.unpack_from(body, pos)
+    pos += schema.double_struct.size
+    counts = []
+    for _ in schema.counts:
+        count, pos = read_varint(body, pos)
+        counts.append(count)
+
+    updates = [(container, dict(zip(names, doubles[start:end])))
+               for container, names, start, end in schema.double_groups]
+    updates += [(container, dict(zip(names, counts[start:end])))
+                for container, names, start, end in schema.count_groups]
+
+    # The catalog-indexed tail is normally all one- or two-byte varints:
+    # tokenize it in one pass and fall back to reading value by value if
+    # anything is off, including tokens that skipped over a longer varint
+    tail = schema.fields[len(doubles) + len(counts):]
+    tokens = VARINT_TOKEN.findall(body, pos, pos + 2 * schema.tail_varints)
+    number = SMALL_VARINT_VALUES.get
+    values = {}
+    index = 0
+    try:
+        for path, kind in tail:
+            if kind == 'theme':
+                values[path] = THEME_CSS[number(tokens[index])]
+                index += 1
+                continue
+            count = number(tokens[index])
+            items = list(map(number, tokens[index + 1:index + 1 + count]))
+            index += 1 + count
+            if len(items) != count or None in items:
+                raise ValueError('Not a small varint array')
+            if kind == 'achievements':
+                values[path] = [ACHIEVEMENT_IDS[number] for number in items]
+            else:
+                ids = UPGRADE_IDS if kind == 'upgrades' else ASSET_IDS
+                if count > len(ids):
+                    raise ValueError('Levels off catalog')
+                values[path] = dict(zip(ids, items))
+                values[path].update((item_id, 0) for item_id in ids[count:])
+        read = b''.join(tokens[:index])
+        if body[pos:pos + len(read)] != read:
+            raise ValueError('Not a run of small varints')
+    except (TypeError, IndexError, ValueError):
+        values = {}
+        for path, kind in tail:
+            values[path], pos = read_value(body, pos, kind)
+    else:
+        pos += len(read)
+
+    updates.append((None, values))
+    return updates, pos
+
+
+def decode_state(data):
+    """Rebuild a game state dict from encode_state() output"""
+    if len(data) < 4 or data[:2] != MAGIC:
+        raise CodecError('Not an encoded game state')
+    version, flags = data[2], data[3]
+    if version not in SCHEMAS:
+        raise CodecError(f'Unsupported state schema {version}')
+    schema = SCHEMAS[version]
+
+    body = data[4:]
+    if flags & FLAG_ZLIB:
+        try:
+            inflater = zlib.decompressobj()
+            body = inflater.decompress(body, MAX_STATE_BYTES)
+        except zlib.error as e:
+            raise CodecError(f'Corrupt compressed state: {e}') from e
+        if inflater.unconsumed_tail:
+            raise CodecError(f'Compressed state inflates past {MAX_STATE_BYTES} bytes')
+
+    try:
+        present, pos = read_varint(body, 0)
+        if present == schema.complete:
+            updates, pos = decode_complete(schema, body, pos)
+        else:
+            updates = []
+            for bit, (path, kind) in enumerate(schema.fields):
+                if present >> bit & 1:
+                    value, pos = read_value(body, pos, kind)
+                    key, _, sub_key = path.partition('.')
+                    updates.append((key, {sub_key: value}) if sub_key else (None, {key: value}))
+
+        length, pos = read_varint(body, pos)
+        game_state = json.loads(bytes(body[pos:pos + length])) if length else {}
+    except (IndexError, struct.error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise CodecError(f'Corrupt game state: {e}') from e
+
+    for container, update in updates:
+        if container:
+            game_state.setdefault(container, {}).update(update)
+        else:
+            game_state.update(update)
+    return game_state
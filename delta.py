@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict, deque
+
+# Dicts with a fixed set of keys are diffed per key ('upgrades.notepad');
+# everything else is sent whole when it changes.
+NESTED_FIELDS = ('upgrades', 'passive_assets', 'stats', 'production')
+
+
+def diff_state(old, new):
+    """Return the set of paths that differ between two game states"""
+    if old is None:
+        return set(new)
+
+    paths = set()
+    for key in old.keys() | new.keys():
+        old_value = old.get(key)
+        new_value = new.get(key)
+        if old_value == new_value:
+            continue
+        if key in NESTED_FIELDS and isinstance(old_value, dict) and isinstance(new_value, dict):
+            for sub_key in old_value.keys() | new_value.keys():
+                if old_value.get(sub_key) != new_value.get(sub_key):
+                    paths.add(f'{key}.{sub_key}')
+        else:
+            paths.add(key)
+    return paths
+
+
+def read_path(game_state, path):
+    key, _, sub_key = path.partition('.')
+    value = game_state.get(key)
+    if sub_key:
+        return value.get(sub_key) if isinstance(value, dict) else None
+    return value
+
+
+class DeltaLog:
+    """Remembers which paths changed in each recent version of each player's state
+
+    The log is per process and bounded; when a client's acknowledged version
+    is not covered, callers fall back to a full snapshot.
+    """
+
+    def __init__(self, versions_per_player=64, max_players=10_000):
+        self.versions_per_player = versions_per_player
+        self.max_players = max_players
+        self._players = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, player_id, version, paths):
+        with self._lock:
+            entries = self._players.get(player_id)
+            if entries is None:
+                entries = deque(maxlen=self.versions_per_player)
+                self._players[player_id] = entries
+                if len(self._players) > self.max_players:
+                    self._players.popitem(last=False)
+            else:
+                self._players.move_to_end(player_id)
+
+            # A gap means another process wrote versions we never saw
+            if entries and entries[-1][0] != version - 1:
+                entries.clear()
+            entries.append((version, frozenset(paths)))
+
+    def changed_since(self, player_id, version, current_version):
+        """Union of paths changed between `version` and `current_version`
+
+        Returns None when the log doesn't cover that whole range.
+        """
+        if version == current_version:
+            return set()
+        with self._lock:
+            entries = self._players.get(player_id)
+            if (not entries or version > current_version
+                    or version < entries[0][0] - 1 or entries[-1][0] != current_version):
+                return None
+            paths = set()
+            for entry_version, entry_paths in entries:
+                if entry_version > version:
+                    paths |= entry_paths
+            return paths
@@ -0,0 +1,734 @@
+import operator
+import random
+from bisect import bisect_right
+from datetime import datetime
+from heapq import heappop
+
+from catalog import (
+    ACHIEVEMENTS, ASSET_COSTS, CLICK_BASE_VALUE, EVENT_IDLE_AFTER, EVENT_MEAN_INTERVAL, MAX_CLICK_BATCH_WINDOW,
+    MILESTONE_LINES, MILESTONES, OFFLINE_THRESHOLD, PASSIVE_ASSETS, PRESTIGE_BONUS_RATE, PRESTIGE_REQUIREMENT,
+    SPECIAL_EVENTS, THEME_CSS, THEME_THRESHOLDS, UPGRADE_COSTS, UPGRADES
+)
+from state import ASSET_IDS, ASSET_INDEX, UPGRADE_IDS, UPGRADE_INDEX, GameState, Production
+
+# The game rules, free of Flask: every action takes the state (a state.GameState),
+# the current time and (where chance is involved) a random source, changes the
+# state in place and returns what the player should be told. Nothing here reads
+# a clock itself, so a change is fully determined by the state, the time and
+# the random source; see transition_rng() and actionlog.py.
+
+class GameError(Exception):
+    """An action the rules don't allow; the message is meant for the player"""
+
+def wall_clock():
+    """Default clock for callers that play in real time"""
+    return datetime.now().timestamp()
+
+# Only used to pick new seeds; every roll of the game comes from transition_rng()
+SEED_SOURCE = random.SystemRandom()
+
+def new_seed():
+    return SEED_SOURCE.getrandbits(63)
+
+def get_new_game_state(now, rng_seed=None):
+    return GameState(now, new_seed() if rng_seed is None else rng_seed)
+
+def transition_rng(game_state):
+    """Random source for the change that takes the state to its next version
+
+    It depends only on the player's seed and that version, so replaying the
+    change draws the same numbers.
+    """
+    return random.Random((game_state.rng_seed << 32) | ((game_state.version + 1) & 0xFFFFFFFF))
+
+ACHIEVEMENT_COMPARATORS = {'>=': operator.ge, '>': operator.gt}
+
+# Fields whose change can unlock an achievement, per action
+CLICK_FIELDS = ('lines_of_code', 'total_clicks', 'longest_session')
+RATE_FIELDS = ('code_per_click', 'code_per_second')
+
+def upgrade_fields(upgrade_id):
+    return (f'upgrades.{upgrade_id}', 'stats.upgrades_purchased', 'stats.upgrades_maxed') + RATE_FIELDS
+
+def asset_fields(asset_id):
+    return (f'passive_assets.{asset_id}', 'stats.assets_purchased', 'stats.assets_maxed') + RATE_FIELDS
+
+def achievement_conditions(achievement):
+    """Normalize an achievement requirement to a list of conditions"""
+    requirement = achievement['requirement']
+    if isinstance(requirement, tuple):
+        return [requirement]
+    return list(requirement)
+
+def build_achievement_index():
+    """Map each state field to its achievements, sorted by threshold
+
+    Each entry is a pair of parallel lists (thresholds, achievement ids) so
+    the achievements a value has reached can be found with bisect.
+    """
+    entries = {}
+    for achievement_id, achievement in ACHIEVEMENTS.items():
+        for field, comparator, threshold in achievement_conditions(achievement):
+            if comparator not in ACHIEVEMENT_COMPARATORS:
+                raise ValueError(f"Unknown comparator {comparator!r} in achievement {achievement_id}")
+            entries.setdefault(field, []).append((threshold, achievement_id))
+
+    index = {}
+    for field, field_entries in entries.items():
+        field_entries.sort()
+        index[field] = ([t for t, _ in field_entries], [a for _, a in field_entries])
+    return index
+
+ACHIEVEMENT_INDEX = build_achievement_index()
+
+def field_getter(field):
+    """Function reading a (possibly dotted) achievement field from a GameState"""
+    section, _, key = field.partition('.')
+    if section == 'upgrades':
+        if key not in UPGRADE_INDEX:
+            return lambda game_state: 0
+        index = UPGRADE_INDEX[key]
+        return lambda game_state: game_state.upgrades[index]
+    if section == 'passive_assets':
+        if key not in ASSET_INDEX:
+            return lambda game_state: 0
+        index = ASSET_INDEX[key]
+        return lambda game_state: game_state.passive_assets[index]
+    getter = operator.attrgetter(field)
+
+    def get(game_state):
+        try:
+            return getter(game_state)
+        except AttributeError:
+            return 0
+    return get
+
+FIELD_GETTERS = {field: field_getter(field) for field in ACHIEVEMENT_INDEX}
+
+def get_state_field(game_state, field):
+    """Read a (possibly dotted) field from the game state, defaulting to 0"""
+    getter = FIELD_GETTERS.get(field)
+    if getter is None:
+        getter = FIELD_GETTERS[field] = field_getter(field)
+    return getter(game_state)
+
+def requirement_met(game_state, achievement):
+    for field, comparator, threshold in achievement_conditions(achievement):
+        if not ACHIEVEMENT_COMPARATORS[comparator](get_state_field(game_state, field), threshold):
+            return False
+    return True
+
+def check_achievements(game_state, fields=None):
+    """Check for newly unlocked achievements
+
+    Only achievements depending on `fields` are evaluated (all of them when
+    None). Rewards that change production re-check the rate fields.
+    """
+    unlocked_ids = set(game_state.achievements)
+    unlocked = []
+    pending_fields = list(ACHIEVEMENT_INDEX if fields is None else fields)
+
+    while pending_fields:
+        field = pending_fields.pop()
+        if field not in ACHIEVEMENT_INDEX:
+            continue
+        thresholds, achievement_ids = ACHIEVEMENT_INDEX[field]
+
+        # Candidates are the achievements whose threshold the value has reached
+        reached = bisect_right(thresholds, get_state_field(game_state, field))
+        for achievement_id in achievement_ids[:reached]:
+            if achievement_id in unlocked_ids:
+                continue
+            achievement = ACHIEVEMENTS[achievement_id]
+            if not requirement_met(game_state, achievement):
+                continue
+
+            unlocked_ids.add(achievement_id)
+            game_state.achievements.append(achievement_id)
+            unlocked.append(achievement_id)
+
+            # Apply rewards if any
+            if achievement['reward']:
+                apply_achievement_reward(game_state, achievement['reward'])
+                pending_fields.extend(RATE_FIELDS)
+
+    return unlocked
+
+def apply_achievement_reward(game_state, reward):
+    """Apply rewards from achievements"""
+    production = game_state.production
+
+    if 'click_bonus' in reward:
+        # Add flat bonus to click power
+        production.click_flat += reward['click_bonus']
+
+    if 'click_multiplier' in reward:
+        # Multiply click power
+        production.click_multiplier *= reward['click_multiplier']
+
+    if 'passive_bonus' in reward:
+        # Add flat bonus to passive income
+        production.passive_flat += reward['passive_bonus']
+
+    if 'passive_multiplier' in reward:
+        # Multiply passive income
+        production.passive_multiplier *= reward['passive_multiplier']
+
+    if 'prestige_bonus' in reward:
+        # Add to prestige multiplier
+        game_state.prestige_multiplier += reward['prestige_bonus']
+
+    recalculate_rates(game_state)
+
+def recalculate_rates(game_state):
+    """Derive code_per_click and code_per_second from the production aggregates
+
+    This is the only place the effective rates are computed.
+    """
+    production = game_state.production
+    prestige_multiplier = game_state.prestige_multiplier
+
+    game_state.code_per_click = (
+        ((CLICK_BASE_VALUE + production.click_base) * prestige_multiplier + production.click_flat)
+        * production.click_multiplier
+    )
+    game_state.code_per_second = (
+        (production.passive_base * prestige_multiplier + production.passive_flat)
+        * production.passive_multiplier
+    )
+
+def add_upgrade_levels(game_state, upgrade_id, count):
+    """Raise an upgrade by `count` levels and update click power in O(1)"""
+    index = UPGRADE_INDEX[upgrade_id]
+    old_level = game_state.upgrades[index]
+    game_state.upgrades[index] += count
+    game_state.production.click_base += UPGRADES[upgrade_id]['click_bonus'] * count
+    if old_level < UPGRADES[upgrade_id]['max_level'] <= old_level + count:
+        game_state.stats.upgrades_maxed += 1
+    recalculate_rates(game_state)
+
+def add_asset_levels(game_state, asset_id, count):
+    """Raise a passive asset by `count` levels and update income in O(1)"""
+    index = ASSET_INDEX[asset_id]
+    old_level = game_state.passive_assets[index]
+    game_state.passive_assets[index] += count
+    game_state.production.passive_base += PASSIVE_ASSETS[asset_id]['income'] * count
+    if old_level < PASSIVE_ASSETS[asset_id]['max_level'] <= old_level + count:
+        game_state.stats.assets_maxed += 1
+    recalculate_rates(game_state)
+
+def rebuild_production(game_state):
+    """Rebuild the production aggregates from levels and unlocked achievements"""
+    production = Production()
+    for upgrade_id, level in zip(UPGRADE_IDS, game_state.upgrades):
+        production.click_base += UPGRADES[upgrade_id]['click_bonus'] * level
+    for asset_id, level in zip(ASSET_IDS, game_state.passive_assets):
+        production.passive_base += PASSIVE_ASSETS[asset_id]['income'] * level
+    game_state.production = production
+
+    for achievement_id in game_state.achievements:
+        reward = ACHIEVEMENTS.get(achievement_id, {}).get('reward')
+        if not reward:
+            continue
+        # prestige_multiplier already includes prestige rewards
+        reward = {k: v for k, v in reward.items() if k != 'prestige_bonus'}
+        apply_achievement_reward(game_state, reward)
+
+    recalculate_rates(game_state)
+
+def count_maxed(levels, item_ids, items):
+    return sum(1 for item_id, level in zip(item_ids, levels) if level >= items[item_id]['max_level'])
+
+def restore_state(data):
+    """Build a GameState from its stored dict form, migrating older saves
+
+    This runs once per load; the state saved afterwards no longer needs it.
+    """
+    game_state = GameState.from_dict(data)
+    if game_state.rng_seed is None:
+        game_state.rng_seed = new_seed()
+    if 'production' not in data:
+        rebuild_production(game_state)
+
+    # Counters behind the declarative 'max level' achievements
+    stats = data.get('stats', {})
+    if 'upgrades_maxed' not in stats:
+        game_state.stats.upgrades_maxed = count_maxed(game_state.upgrades, UPGRADE_IDS, UPGRADES)
+    if 'assets_maxed' not in stats:
+        game_state.stats.assets_maxed = count_maxed(game_state.passive_assets, ASSET_IDS, PASSIVE_ASSETS)
+    return game_state
+
+def update_session_time(game_state, now):
+    """Update the session time tracking"""
+    session_length = now - game_state.last_session_start
+
+    # If this is a new session (more than 30 min gap)
+    if session_length > 1800:
+        game_state.last_session_start = now
+    else:
+        # Update longest session if current one is longer
+        if session_length > game_state.longest_session:
+            game_state.longest_session = session_length
+
+def current_theme(lines_of_code):
+    """CSS of the best theme unlocked at this many lines"""
+    return THEME_CSS[bisect_right(THEME_THRESHOLDS, lines_of_code) - 1]
+
+def next_milestone(lines_of_code):
+    """The first theme, tier or line achievement not reached at this many lines
+
+    Returns the milestone with 'lines_to_go' added, or None past the last one.
+    """
+    index = bisect_right(MILESTONE_LINES, lines_of_code)
+    if index == len(MILESTONES):
+        return None
+    milestone = MILESTONES[index]
+    return {**milestone, 'lines_to_go': milestone['lines'] - lines_of_code}
+
+def start_event(game_state, event_key, now):
+    """Add a special event to the active events"""
+    event = SPECIAL_EVENTS[event_key]
+
+    event_data = {
+        'id': event_key,
+        'name': event['name'],
+        'description': event['description'],
+        'action': event['action'],
+        'start_time': now,
+        'end_time': now + event.get('time_limit', 60),  # Default 1 minute
+        'completed': False
+    }
+
+    # Customize event based on current game state
+    if 'target_multiplier' in event:
+        event_data['target'] = game_state.lines_of_code * event['target_multiplier']
+
+    game_state.active_events.append(event_data)
+    game_state.event_cooldowns[event_key] = now + event.get('cooldown', 0)
+    game_state.schedule(event_data['end_time'], 'event', event_key)
+    return event_data
+
+EVENT_IDS = list(SPECIAL_EVENTS)
+EVENT_WEIGHTS = [SPECIAL_EVENTS[event_id].get('weight', 1) for event_id in EVENT_IDS]
+
+def pick_event(game_state, now, rng):
+    """Weighted choice among the events not cooling down, or None"""
+    cooldowns = game_state.event_cooldowns
+    if not cooldowns:
+        return rng.choices(EVENT_IDS, EVENT_WEIGHTS)[0]
+    ready = [i for i, event_id in enumerate(EVENT_IDS) if cooldowns.get(event_id, 0) <= now]
+    if not ready:
+        return None
+    return EVENT_IDS[rng.choices(ready, [EVENT_WEIGHTS[i] for i in ready])[0]]
+
+def schedule_next_event(game_state, now, rng):
+    """Draw when the next event arrives; arrivals are a Poisson process"""
+    game_state.next_event_roll = now + rng.expovariate(1 / EVENT_MEAN_INTERVAL)
+    game_state.schedule(game_state.next_event_roll, 'roll')
+
+def trigger_event(game_state, now, rng=random):
+    """Start the event whose arrival time has come, and draw the next arrival
+
+    next_event_roll holds the one upcoming arrival (0 until the first is
+    drawn), so when nothing is due this is a single comparison. An arrival
+    while another event runs, with every event cooling down, or while the
+    player is idle (an open page left alone gets arrivals from its ticks, and
+    nobody is there to see or fix the event) is skipped.
+    """
+    if now < game_state.next_event_roll:
+        return None
+
+    event = None
+    active = now - game_state.last_active <= EVENT_IDLE_AFTER
+    if game_state.next_event_roll and active and not game_state.active_events:
+        event_key = pick_event(game_state, now, rng)
+        if event_key is not None:
+            event = start_event(game_state, event_key, now)
+    schedule_next_event(game_state, now, rng)
+    return event
+
+def add_multiplier(game_state, source, target, value, start, duration):
+    """Start a temporary multiplier on `target`, replacing any other from the same source"""
+    multiplier = {'target': target, 'value': value, 'start_time': start, 'end_time': start + duration}
+    game_state.temporary_multipliers[source] = multiplier
+    game_state.index_multipliers(start)
+    game_state.schedule(multiplier['end_time'], 'multiplier_end', source)
+    game_state.schedule(multiplier['end_time'] + MAX_CLICK_BATCH_WINDOW, 'multiplier', source)
+    return multiplier
+
+def deadline_current(game_state, deadline):
+    """Whether a heap entry still refers to something that falls due then"""
+    when, kind, key = deadline
+    if kind == 'roll':
+        return when == game_state.next_event_roll
+    if kind == 'event':
+        return any(e['id'] == key and e['end_time'] == when and not e.get('completed')
+                   for e in game_state.active_events)
+    multiplier = game_state.temporary_multipliers.get(key)
+    if multiplier is None:
+        return False
+    if kind == 'multiplier_end':
+        return multiplier['end_time'] == when
+    return multiplier['end_time'] + MAX_CLICK_BATCH_WINDOW == when
+
+def pop_deadline(game_state, now):
+    """Remove and return the earliest deadline at or before `now`, or None"""
+    deadlines = game_state.deadlines
+    while deadlines and deadlines[0][0] <= now:
+        deadline = heappop(deadlines)
+        if deadline_current(game_state, deadline):
+            return deadline
+    return None
+
+def next_deadline(game_state):
+    """Earliest time at which advance() has something to do"""
+    deadlines = game_state.deadlines
+    while deadlines and not deadline_current(game_state, deadlines[0]):
+        heappop(deadlines)
+    return deadlines[0][0] if deadlines else float('inf')
+
+def fail_event(game_state, event, now):
+    """An event ran out of time: drop it and apply the failure in SPECIAL_EVENTS"""
+    game_state.active_events = [e for e in game_state.active_events if e is not event]
+    failure = SPECIAL_EVENTS.get(event['id'], {}).get('failure') or {}
+
+    if 'lines_penalty' in failure:
+        game_state.lines_of_code *= 1 - failure['lines_penalty']
+
+    if 'production_penalty' in failure:
+        add_multiplier(game_state, f"{event['id']}_penalty", 'passive',
+                       1 - failure['production_penalty'], now, failure['duration'])
+
+def apply_deadline(game_state, deadline):
+    """Expire whatever fell due at this deadline"""
+    when, kind, key = deadline
+    if kind == 'event':
+        for event in game_state.active_events:
+            if event['id'] == key and event['end_time'] == when:
+                fail_event(game_state, event, when)
+                break
+    elif kind == 'multiplier_end':
+        game_state.index_multipliers(game_state.last_tick)
+    elif kind == 'multiplier':
+        # Kept for MAX_CLICK_BATCH_WINDOW seconds after its end so a click batch
+        # covering that time still gets it for the right share
+        del game_state.temporary_multipliers[key]
+    # Event arrivals only happen at the current time, see advance()
+
+def multiplier_segments(game_state, target, start, end):
+    """Split [start, end] where `target` multipliers start or end
+
+    Returns (segment_start, segment_end, multiplier) tuples where the
+    multiplier is the product of the multipliers active throughout the
+    segment. The boundaries are swept in order keeping a running product, so
+    the cost is O(number of boundaries) regardless of the interval length.
+    With start == end a single zero-length segment is returned.
+    """
+    multiplier = 1
+    changes = []
+    for mult_id, m in game_state.temporary_multipliers.items():
+        mult_start = m.get('start_time', start)
+        if m.get('target', mult_id) != target or m['end_time'] <= start or mult_start > end:
+            continue
+        if mult_start > start:
+            changes.append((mult_start, m['value']))
+        else:
+            multiplier *= m['value']
+        if m['end_time'] < end:
+            changes.append((m['end_time'], 1 / m['value']))
+    changes.sort()
+
+    segments = []
+    segment_start = start
+    for change_time, factor in changes:
+        if change_time > segment_start:
+            segments.append((segment_start, change_time, multiplier))
+            segment_start = change_time
+        multiplier *= factor
+    segments.append((segment_start, end, multiplier))
+    return segments
+
+def average_multiplier(game_state, target, start, end):
+    """Time-weighted average of the `target` multipliers over [start, end]"""
+    segments = multiplier_segments(game_state, target, start, end)
+    if end <= start:
+        return segments[-1][2]
+    return sum((seg_end - seg_start) * value for seg_start, seg_end, value in segments) / (end - start)
+
+def advance(game_state, now, rng=random):
+    """Bring the state forward to `now`
+
+    Passive income since last_tick is credited lazily. Every deadline that
+    fell due on the way (event and multiplier expiry) is applied at its own
+    time, and the passive multiplier only changes at deadlines, so income is
+    credited in closed form between them. This is the only place passive
+    income is added.
+
+    Returns an offline earnings summary when the player was away for more
+    than OFFLINE_THRESHOLD seconds, otherwise None.
+    """
+    start_time = game_state.last_tick
+    passive_income = 0
+    segments = []
+
+    # Walk the deadlines in order, crediting income up to each one first, so
+    # a penalty lands when it fell due even if nobody was looking
+    while True:
+        deadline = pop_deadline(game_state, now)
+        until = deadline[0] if deadline else now
+        if until > game_state.last_tick:
+            multiplier = game_state.effective_multipliers['passive']
+            income = game_state.code_per_second * multiplier * (until - game_state.last_tick)
+            segments.append({
+                'start': game_state.last_tick,
+                'end': until,
+                'multiplier': multiplier,
+                'lines': income
+            })
+            game_state.lines_of_code += income
+            game_state.last_tick = until
+            passive_income += income
+        if deadline is None:
+            break
+        apply_deadline(game_state, deadline)
+
+    # Update stats for passive income
+    game_state.stats.total_lines_written += passive_income
+    game_state.stats.total_lines_from_passive += passive_income
+
+    # An arrival missed while away happens once, now; arrivals are
+    # memoryless, so the next one is drawn from here
+    trigger_event(game_state, now, rng)
+
+    if now - start_time > OFFLINE_THRESHOLD:
+        return {
+            'seconds_away': now - start_time,
+            'lines_earned': passive_income,
+            'segments': segments
+        }
+    return None
+
+def start_session(game_state, now):
+    """Page load: session time, any achievements not yet awarded, and the theme"""
+    update_session_time(game_state, now)
+    new_achievements = check_achievements(game_state)
+    game_state.theme = current_theme(game_state.lines_of_code)
+    return {'new_achievements': new_achievements}
+
+def click(game_state, count, now, window=0, rng=random):
+    """Apply `count` clicks spread evenly over the `window` seconds before `now`"""
+    stats = game_state.stats
+
+    # Track clicks
+    game_state.total_clicks += count
+    stats.total_clicks += count
+
+    # The cached multiplier holds unless it changed during the window; then
+    # multipliers that expired part-way through only count for the clicks
+    # made before they expired
+    if now - window >= game_state.multipliers_since['click']:
+        click_multiplier = game_state.effective_multipliers['click']
+    else:
+        click_multiplier = average_multiplier(game_state, 'click', now - window, now)
+
+    # Add lines from clicks with any temporary multipliers
+    base_click_value = game_state.code_per_click
+    actual_click_value = base_click_value * click_multiplier * count
+    game_state.lines_of_code += actual_click_value
+
+    # Update stats
+    stats.total_lines_written += actual_click_value
+    stats.total_lines_from_clicks += actual_click_value
+    if base_click_value > stats.highest_lines_per_click:
+        stats.highest_lines_per_click = base_click_value
+
+    # Update session time
+    update_session_time(game_state, now)
+
+    # Check for achievements
+    new_achievements = check_achievements(game_state, CLICK_FIELDS)
+
+    # Events arrive with time, not clicks: this is one comparison, and
+    # advance() has usually started anything due already
+    new_event = trigger_event(game_state, now, rng)
+
+    return {'new_achievements': new_achievements, 'new_event': new_event}
+
+def complete_code_review(game_state, now):
+    """Buying an upgrade during a code review completes it"""
+    for event in game_state.active_events:
+        if event['id'] == 'code_review' and not event['completed']:
+            event['completed'] = True
+
+            # Apply reward - temporary boost to production
+            reward = SPECIAL_EVENTS['code_review']['reward']
+            add_multiplier(game_state, 'code_review', 'passive', 1 + reward['lines_bonus'], now, reward['duration'])
+            return event
+    return None
+
+# Per kind of purchasable item: catalog section, level array attribute, index
+# into it, price tables, level adder, purchase counter and achievement fields
+PURCHASE_KINDS = {
+    'upgrade': (UPGRADES, 'upgrades', UPGRADE_INDEX, UPGRADE_COSTS, add_upgrade_levels,
+                'upgrades_purchased', upgrade_fields),
+    'asset': (PASSIVE_ASSETS, 'passive_assets', ASSET_INDEX, ASSET_COSTS, add_asset_levels,
+              'assets_purchased', asset_fields)
+}
+
+def item_level(game_state, kind, item_id):
+    items, levels, index, *_ = PURCHASE_KINDS[kind]
+    return getattr(game_state, levels)[index[item_id]]
+
+def max_affordable(game_state, kind, item_id):
+    """Levels of an item the player can pay for right now"""
+    cost_tables = PURCHASE_KINDS[kind][3]
+    return cost_tables[item_id].max_affordable(item_level(game_state, kind, item_id), game_state.lines_of_code)
+
+def buy(game_state, kind, item_id, count, now):
+    """Buy `count` levels (or 'max') of an upgrade or passive asset"""
+    if kind not in PURCHASE_KINDS:
+        raise GameError('Invalid item type')
+    items, _, _, cost_tables, add_levels, purchase_counter, fields = PURCHASE_KINDS[kind]
+    if item_id not in items:
+        raise GameError(f'Invalid {kind}')
+
+    if count == 'max':
+        count = max_affordable(game_state, kind, item_id)
+
+    current_level = item_level(game_state, kind, item_id)
+    max_level = items[item_id]['max_level']
+
+    # Check if we're at max level
+    if current_level >= max_level:
+        raise GameError('Max level reached')
+
+    # Adjust count if it would exceed max level
+    count = min(count, max_level - current_level)
+
+    # Calculate total cost
+    total_cost = cost_tables[item_id].bulk_cost(current_level, count)
+
+    if count <= 0 or game_state.lines_of_code < total_cost:
+        raise GameError('Not enough lines of code')
+
+    # Purchase successful
+    stats = game_state.stats
+    game_state.lines_of_code -= total_cost
+    add_levels(game_state, item_id, count)
+    setattr(stats, purchase_counter, getattr(stats, purchase_counter) + count)
+
+    # Update stats
+    if game_state.code_per_second > stats.highest_lines_per_second:
+        stats.highest_lines_per_second = game_state.code_per_second
+
+    # Check for achievements
+    new_achievements = check_achievements(game_state, fields(item_id))
+
+    # Check if this purchase completes any active events
+    event_completed = complete_code_review(game_state, now) if kind == 'upgrade' else None
+
+    return {
+        'new_achievements': new_achievements,
+        'event_completed': event_completed,
+        'purchased': count
+    }
+
+def prestige_bonus(game_state):
+    """Multiplier a prestige would add right now"""
+    return (game_state.lines_of_code / PRESTIGE_REQUIREMENT) * PRESTIGE_BONUS_RATE
+
+# Kept through a prestige; everything else starts over
+PRESTIGE_KEPT = ('version', 'rng_seed', 'achievements', 'stats')
+
+def prestige(game_state, now):
+    """Reset progress for a permanent multiplier; the state is replaced in place"""
+    if game_state.lines_of_code < PRESTIGE_REQUIREMENT:
+        raise GameError('Not enough lines to prestige')
+
+    # Calculate prestige bonus
+    bonus = 1 + prestige_bonus(game_state)
+
+    # Save some stats before reset
+    game_state.stats.total_prestiges += 1
+
+    # Reset game but keep prestige level and multiplier
+    new_state = get_new_game_state(now)
+    for name in PRESTIGE_KEPT:
+        setattr(new_state, name, getattr(game_state, name))
+    new_state.prestige_level = game_state.prestige_level + 1
+    new_state.prestige_multiplier = game_state.prestige_multiplier + bonus
+
+    # Achievement rewards survive the reset; purchased levels do not
+    for name in ('click_flat', 'click_multiplier', 'passive_flat', 'passive_multiplier'):
+        setattr(new_state.production, name, getattr(game_state.production, name))
+    recalculate_rates(new_state)
+
+    for name in GameState.__slots__:
+        setattr(game_state, name, getattr(new_state, name))
+
+    # Check for new achievements
+    new_achievements = check_achievements(game_state)
+
+    return {'new_achievements': new_achievements, 'prestige_bonus': bonus}
+
+def complete_event(game_state, event_id, now):
+    """Finish an active event the player completed and grant its reward"""
+    event_completed = None
+    for event in game_state.active_events:
+        if event['id'] == event_id and not event['completed']:
+            event['completed'] = True
+            event_completed = event
+
+            # Apply event-specific rewards
+            if event_id == 'bug_found':
+                # Temporary click multiplier
+                reward = SPECIAL_EVENTS['bug_found']['reward']
+                add_multiplier(game_state, 'bug_found', 'click', reward['temporary_click_multiplier'],
+                               now, reward['duration'])
+
+            elif event_id == 'hackathon':
+                # Check if the target was reached
+                if game_state.lines_of_code >= event['target']:
+                    # Unlock a special one-time upgrade
+                    special_unlocks = game_state.special_unlocks or []
+                    if 'hackathon_trophy' not in special_unlocks:
+                        game_state.special_unlocks = special_unlocks + ['hackathon_trophy']
+
+                        # Add bonus lines
+                        bonus = game_state.lines_of_code * 0.1  # 10% bonus
+                        game_state.lines_of_code += bonus
+
+            break
+
+    # Remove completed events
+    game_state.active_events = [e for e in game_state.active_events if not e['completed']]
+
+    return {'event_completed': event_completed}
+
+def set_bulk_buy_mode(game_state, type_key, mode):
+    """Remember how many levels the buy buttons purchase: 1, 10, 100 or 'max'"""
+    if type_key not in ['upgrades', 'assets']:
+        raise GameError('Invalid type')
+
+    if mode not in [1, 10, 100, 'max']:
+        raise GameError('Invalid mode')
+
+    game_state.bulk_buy_mode[type_key] = mode
+    return {'success': True, 'bulk_buy_mode': dict(game_state.bulk_buy_mode)}
+
+# Player actions by name, as the routes run them and actionlog.py replays
+# them: name -> function(game_state, now, rng, *args)
+def run_action(game_state, name, now, rng, *args):
+    """Apply one of ACTIONS; the player counts as active as of `now`"""
+    result = ACTIONS[name](game_state, now, rng, *args)
+    game_state.last_active = now
+    return result
+
+ACTIONS = {
+    'start_session': lambda game_state, now, rng: start_session(game_state, now),
+    'click': lambda game_state, now, rng, count, window=0: click(game_state, count, now, window, rng),
+    'buy': lambda game_state, now, rng, kind, item_id, count: buy(game_state, kind, item_id, count, now),
+    'prestige': lambda game_state, now, rng: prestige(game_state, now),
+    'complete_event': lambda game_state, now, rng, event_id: complete_event(game_state, event_id, now),
+    'set_bulk_buy_mode': lambda game_state, now, rng, type_key, mode: set_bulk_buy_mode(game_state, type_key, mode)
+}
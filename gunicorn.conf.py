@@ -0,0 +1,39 @@
+import multiprocessing
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Every worker must see the same session secret: set CODE_EMPIRE_SECRET_KEY,
+# or let the first worker create the key file in the instance folder (shared
+# by the workers of one machine). Use the SQLite store (or another shared
+# one); with 'memory://' each worker would hold its own players.
+
+bind = os.environ.get('CODE_EMPIRE_BIND', '0.0.0.0:8000')
+
+# Requests are short and CPU bound, so roughly one worker per core
+workers = int(os.environ.get('CODE_EMPIRE_WORKERS', multiprocessing.cpu_count()))
+
+# The write-behind cache and its journal belong to one process
+if int(os.environ.get('CODE_EMPIRE_CACHE_SIZE', 0)) and workers > 1:
+    raise SystemExit('CODE_EMPIRE_CACHE_SIZE needs CODE_EMPIRE_WORKERS=1 (connections still scale)')
+
+# Every open page keeps its /events/stream connection for as long as it is
+# open, so requests are served by gevent (pip install gevent): each one, short
+# or streaming, is a greenlet, and an open page costs a little memory instead
+# of a thread. Short requests never wait behind open pages.
+worker_class = os.environ.get('CODE_EMPIRE_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('CODE_EMPIRE_CONNECTIONS', 10_000))
+
+# Only for CODE_EMPIRE_WORKER_CLASS=gthread, where every open page holds one of
+# these threads and the rest serve everyone's short requests
+threads = int(os.environ.get('CODE_EMPIRE_THREADS', 32))
+
+# Browsers keep the connection open between clicks
+keepalive = 30
+
+# Recycle workers now and then to bound any slow growth in memory
+max_requests = 100_000
+max_requests_jitter = 10_000
+
+# Each worker opens its own store connections after the fork
+preload_app = False
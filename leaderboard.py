@@ -0,0 +1,517 @@
+import hashlib
+import random
+import sqlite3
+import threading
+
+from delta import read_path
+from storage import GameStore, connection_local, state_version
+
+# Cross-player rankings.
+#
+# A leaderboard backend holds one sorted set per board with the Redis
+# sorted-set commands used here (zadd, zrem, zscore, zrevrank, zrevrange,
+# zcard), so a redis-py client can be used as a backend as it is. Members
+# are player ids; ranks are 0-based from the top and ties are broken by
+# member, as in Redis. The built-in backends also have zadd_boards(), which
+# sets scores on several boards at once; with Redis a pipeline does that.
+
+KEY_PREFIX = 'leaderboard:'
+
+
+def number(value):
+    return float(value or 0)
+
+
+def count(value):
+    return float(len(value or ()))
+
+
+# Board name -> (title, state path of the score, how the value becomes a score)
+BOARDS = {
+    'total_lines': ('Total Lines Written', 'stats.total_lines_written', number),
+    'prestige': ('Prestige Level', 'prestige_level', number),
+    'lines_per_second': ('Highest Lines/Second', 'stats.highest_lines_per_second', number),
+    'achievements': ('Achievements', 'achievements', count)
+}
+
+
+def board_key(board):
+    return KEY_PREFIX + board
+
+
+def board_scores(game_state):
+    """Score of a state (dict form) on every board"""
+    return {board: to_score(read_path(game_state, path)) for board, (_, path, to_score) in BOARDS.items()}
+
+
+def player_tag(player_id):
+    """Public name of a player; ids are kept private"""
+    return 'dev-' + hashlib.sha256(player_id.encode()).hexdigest()[:8]
+
+
+class SkipListNode:
+    __slots__ = ('key', 'forward', 'span')
+
+    def __init__(self, key, level):
+        self.key = key               # (score, member)
+        self.forward = [None] * level
+        self.span = [0] * level      # nodes skipped by each forward link
+
+
+class SkipList:
+    """Sorted (score, member) pairs with O(log n) insert, delete, rank and index lookup
+
+    The indexable skip list Redis uses for sorted sets: every link also
+    counts how many nodes it jumps over, so ranks come out of the search path.
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self.head = SkipListNode(None, self.MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+
+    def random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and self.rng.random() < self.P:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [None] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while node.forward[i] is not None and node.forward[i].key < key:
+                rank[i] += node.span[i]
+                node = node.forward[i]
+            update[i] = node
+
+        level = self.random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.span[i] = self.length
+            self.level = level
+
+        new = SkipListNode(key, level)
+        for i in range(level):
+            new.forward[i] = update[i].forward[i]
+            update[i].forward[i] = new
+            new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        self.length += 1
+
+    def delete(self, key):
+        update = [None] * self.MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key < key:
+                node = node.forward[i]
+            update[i] = node
+
+        node = node.forward[0]
+        if node is None or node.key != key:
+            return False
+        for i in range(self.level):
+            if update[i].forward[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].span[i] -= 1
+        while self.level > 1 and self.head.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def rank(self, key):
+        """0-based position of `key` in ascending order, or None"""
+        traversed = 0
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key <= key:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if node.key == key:
+                return traversed - 1
+        return None
+
+    def node_at(self, index):
+        """Node at 0-based position `index` in ascending order"""
+        traversed = 0
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.forward[i] is not None and traversed + node.span[i] <= index + 1:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if traversed == index + 1:
+                return node
+        return None
+
+    def slice(self, start, stop):
+        """Keys at ascending positions start..stop inclusive: O(log n + k)"""
+        node = self.node_at(start)
+        keys = []
+        while node is not None and len(keys) < stop - start + 1:
+            keys.append(node.key)
+            node = node.forward[0]
+        return keys
+
+
+def clamp_range(start, stop, length):
+    """Redis-style inclusive range with negative indices, or None if empty"""
+    if start < 0:
+        start = max(length + start, 0)
+    if stop < 0:
+        stop += length
+    stop = min(stop, length - 1)
+    if start > stop:
+        return None
+    return start, stop
+
+
+class MemoryLeaderboard:
+    """In-process sorted sets: a skip list plus a score dict per board"""
+
+    def __init__(self):
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def _set(self, key):
+        if key not in self._sets:
+            self._sets[key] = (SkipList(), {})
+        return self._sets[key]
+
+    def zadd(self, key, mapping):
+        added = 0
+        with self._lock:
+            ranking, scores = self._set(key)
+            for member, score in mapping.items():
+                old = scores.get(member)
+                if old == score:
+                    continue
+                if old is None:
+                    added += 1
+                else:
+                    ranking.delete((old, member))
+                ranking.insert((score, member))
+                scores[member] = score
+        return added
+
+    def zadd_boards(self, mappings):
+        """zadd() on several boards: {key: {member: score}}"""
+        for key, mapping in mappings.items():
+            self.zadd(key, mapping)
+
+    def zrem(self, key, *members):
+        removed = 0
+        with self._lock:
+            ranking, scores = self._set(key)
+            for member in members:
+                if member in scores:
+                    ranking.delete((scores.pop(member), member))
+                    removed += 1
+        return removed
+
+    def zscore(self, key, member):
+        with self._lock:
+            return self._set(key)[1].get(member)
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._set(key)[1])
+
+    def zrevrank(self, key, member):
+        with self._lock:
+            ranking, scores = self._set(key)
+            if member not in scores:
+                return None
+            return ranking.length - 1 - ranking.rank((scores[member], member))
+
+    def zrevrange(self, key, start, stop, withscores=False):
+        with self._lock:
+            ranking, _ = self._set(key)
+            bounds = clamp_range(start, stop, ranking.length)
+            if bounds is None:
+                return []
+            # Descending positions start..stop are ascending ones mirrored
+            last = ranking.length - 1
+            keys = ranking.slice(last - bounds[1], last - bounds[0])
+        keys.reverse()
+        if withscores:
+            return [(member, score) for score, member in keys]
+        return [member for _, member in keys]
+
+    def close(self):
+        pass
+
+
+class SQLiteLeaderboard:
+    """Sorted sets kept in a SQLite table and ranked through an in-process skip list
+
+    The table is the durable copy, shared by every worker on the machine.
+    Each write stamps its row with the next value of a sequence (a removal
+    leaves a tombstone row), and each process mirrors the table into a
+    MemoryLeaderboard, first applying the rows stamped since it last looked.
+    So zrevrank() and zrevrange() are skip-list lookups, O(log n) and
+    O(log n + k), in every worker, and catching up costs O(log n) per change.
+    The price is that every process holds every board in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = connection_local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS leaderboard_scores ('
+            ' board TEXT NOT NULL,'
+            ' member TEXT NOT NULL,'
+            ' score REAL NOT NULL,'
+            ' removed INTEGER NOT NULL DEFAULT 0,'
+            ' seq INTEGER,'
+            ' PRIMARY KEY (board, member))'
+        )
+        self._add_sequence_columns(conn)
+        conn.execute('CREATE INDEX IF NOT EXISTS leaderboard_changes ON leaderboard_scores (seq)')
+        conn.commit()
+
+        self._index = MemoryLeaderboard()
+        self._seen = 0     # highest sequence applied to the index
+        self._sync_lock = threading.Lock()
+
+    def _add_sequence_columns(self, conn):
+        """Tables from before the index was mirrored have no sequence or tombstones"""
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(leaderboard_scores)')]
+        if 'seq' in columns:
+            return
+        conn.execute('ALTER TABLE leaderboard_scores ADD COLUMN removed INTEGER NOT NULL DEFAULT 0')
+        conn.execute('ALTER TABLE leaderboard_scores ADD COLUMN seq INTEGER')
+        conn.execute('UPDATE leaderboard_scores SET seq = rowid')
+        conn.execute('DROP INDEX IF EXISTS leaderboard_ranking')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _sync(self):
+        """Apply the rows written since the last look, by any process, to the index"""
+        with self._sync_lock:
+            # Writes are serialized, so sequences are handed out in commit
+            # order and nothing can still appear below the last one seen
+            rows = self._connect().execute(
+                'SELECT seq, board, member, score, removed FROM leaderboard_scores '
+                'WHERE seq > ? ORDER BY seq',
+                (self._seen,)
+            ).fetchall()
+            for _, key, member, score, removed in rows:
+                if removed:
+                    self._index.zrem(key, member)
+                else:
+                    self._index.zadd(key, {member: score})
+            if rows:
+                self._seen = rows[-1][0]
+        return self._index
+
+    def zadd(self, key, mapping):
+        """Unlike Redis, returns how many scores changed rather than how many members are new"""
+        return self.zadd_boards({key: mapping})
+
+    def zadd_boards(self, mappings):
+        """Set scores on several boards ({key: {member: score}}) in one transaction
+
+        Scores the caught-up index already has are dropped before anything is
+        written, so a save that moved no score writes nothing. Returns how
+        many scores changed.
+        """
+        index = self._sync()
+        rows = [(key, member, score) for key, mapping in mappings.items()
+                for member, score in mapping.items() if index.zscore(key, member) != score]
+        if not rows:
+            return 0
+        conn = self._connect()
+        conn.executemany(
+            'INSERT INTO leaderboard_scores (board, member, score, seq) '
+            'VALUES (?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM leaderboard_scores)) '
+            'ON CONFLICT(board, member) DO UPDATE SET score = excluded.score, removed = 0, seq = excluded.seq',
+            rows
+        )
+        conn.commit()
+        return len(rows)
+
+    def zrem(self, key, *members):
+        conn = self._connect()
+        cursor = conn.executemany(
+            'UPDATE leaderboard_scores SET removed = 1, '
+            ' seq = (SELECT MAX(seq) + 1 FROM leaderboard_scores) '
+            'WHERE board = ? AND member = ? AND NOT removed',
+            [(key, member) for member in members]
+        )
+        conn.commit()
+        return cursor.rowcount
+
+    def zscore(self, key, member):
+        row = self._connect().execute(
+            'SELECT score FROM leaderboard_scores WHERE board = ? AND member = ? AND NOT removed', (key, member)
+        ).fetchone()
+        return row[0] if row else None
+
+    def zcard(self, key):
+        return self._sync().zcard(key)
+
+    def zrevrank(self, key, member):
+        return self._sync().zrevrank(key, member)
+
+    def zrevrange(self, key, start, stop, withscores=False):
+        return self._sync().zrevrange(key, start, stop, withscores)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_leaderboard(url):
+    """Build a leaderboard backend: 'memory://', 'sqlite:///path' or 'redis://...'"""
+    if url == 'memory://':
+        return MemoryLeaderboard()
+    if url.startswith('sqlite:///'):
+        return SQLiteLeaderboard(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError('Redis leaderboards need the redis package (pip install redis)') from None
+        return redis.Redis.from_url(url, decode_responses=True)
+    raise ValueError(f'Unsupported leaderboard: {url}')
+
+
+def rank_players(leaderboard, items):
+    """Put the scores of (player_id, game_state) pairs on every board in one batch"""
+    mappings = {board_key(board): {} for board in BOARDS}
+    for player_id, game_state in items:
+        for board, score in board_scores(game_state).items():
+            mappings[board_key(board)][player_id] = score
+    if hasattr(leaderboard, 'zadd_boards'):
+        leaderboard.zadd_boards(mappings)
+        return
+    # redis-py: one round trip for every board
+    pipeline = leaderboard.pipeline(transaction=False)
+    for key, mapping in mappings.items():
+        if mapping:
+            pipeline.zadd(key, mapping)
+    pipeline.execute()
+
+
+class RankingGameStore(GameStore):
+    """Passes states through to another store, ranking them on the way
+
+    Scores are not written with each save: the latest state of each player
+    saved since the last batch is kept, and a background thread puts them
+    on every board in one batch every `flush_interval` seconds. Placed under
+    the write-behind cache, that is the states of its flushes.
+    """
+
+    def __init__(self, backing, leaderboard, flush_interval=1.0):
+        self.backing = backing
+        self.leaderboard = leaderboard
+        self._pending = {}   # player id -> latest saved state not ranked yet
+        self._lock = threading.Lock()
+        # Serializes batches, so an older one never lands after a newer one
+        self._rank_lock = threading.Lock()
+
+        self._stopped = threading.Event()
+        self._ranker = None
+        if flush_interval:
+            self._ranker = threading.Thread(target=self._rank_periodically, args=(flush_interval,),
+                                            name='leaderboard-ranker', daemon=True)
+            self._ranker.start()
+
+    def _queue(self, items):
+        with self._lock:
+            for player_id, game_state in items:
+                # Concurrent saves can get here out of order
+                queued = self._pending.get(player_id)
+                if queued is None or state_version(game_state) >= state_version(queued):
+                    self._pending[player_id] = game_state
+
+    def rank(self):
+        """Put the states queued so far on the boards"""
+        with self._rank_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending:
+                rank_players(self.leaderboard, pending.items())
+
+    def _rank_periodically(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.rank()
+            except Exception:
+                # Those scores are lost until the player's next save
+                pass
+
+    def load(self, player_id):
+        return self.backing.load(player_id)
+
+    def save(self, player_id, game_state):
+        self.backing.save(player_id, game_state)
+        self._queue([(player_id, game_state)])
+
+    def save_many(self, items):
+        items = list(items)
+        self.backing.save_many(items)
+        self._queue(items)
+
+    def compare_and_save(self, player_id, game_state, expected_version):
+        self.backing.compare_and_save(player_id, game_state, expected_version)
+        self._queue([(player_id, game_state)])
+
+    def delete(self, player_id):
+        self.backing.delete(player_id)
+        with self._rank_lock:
+            with self._lock:
+                self._pending.pop(player_id, None)
+            for board in BOARDS:
+                self.leaderboard.zrem(board_key(board), player_id)
+
+    def flush(self, player_id=None):
+        self.backing.flush(player_id)
+
+    def close(self):
+        self._stopped.set()
+        if self._ranker is not None:
+            self._ranker.join()
+        self.rank()
+        self.backing.close()
+        self.leaderboard.close()
+
+
+def standings(leaderboard, player_id, limit=10):
+    """Top `limit` players of every board and where `player_id` stands"""
+    result = {}
+    for board, (title, _, _) in BOARDS.items():
+        key = board_key(board)
+        top = leaderboard.zrevrange(key, 0, limit - 1, withscores=True)
+        rank = leaderboard.zrevrank(key, player_id)
+        result[board] = {
+            'title': title,
+            'top': [
+                {'rank': index + 1, 'player': player_tag(member), 'score': score, 'me': member == player_id}
+                for index, (member, score) in enumerate(top)
+            ],
+            'me': {'rank': rank + 1, 'score': leaderboard.zscore(key, player_id)} if rank is not None else None
+        }
+    return result
@@ -0,0 +1,92 @@
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def cost_factors(multiplier, levels):
+    """multiplier ** level for every level below `levels`"""
+    if np is not None:
+        return multiplier ** np.arange(levels, dtype=np.float64)
+    factors = array('d')
+    factor = 1.0
+    for _ in range(levels):
+        factors.append(factor)
+        factor *= multiplier
+    return factors
+
+
+def prefix_sums(values):
+    """Running totals with a leading zero, so sums[b] - sums[a] covers values[a:b]"""
+    if np is not None:
+        return np.concatenate(([0.0], np.cumsum(values)))
+    sums = array('d', [0.0])
+    total = 0.0
+    for value in values:
+        total += value
+        sums.append(total)
+    return sums
+
+
+class CostTable:
+    """Price of every level of one catalog item, and running totals of them
+
+    Levels are capped per item, so the whole price curve fits in two small
+    arrays built at startup; single, bulk and range prices are one lookup or
+    one subtraction.
+    """
+
+    def __init__(self, base_cost, max_level, multiplier):
+        self.max_level = max_level
+        factors = cost_factors(multiplier, max_level)
+        if np is not None:
+            self.costs = base_cost * factors
+        else:
+            self.costs = array('d', (base_cost * factor for factor in factors))
+        self.cumulative = prefix_sums(self.costs)
+
+    def cost(self, level):
+        """Price of the next level when `level` are already owned"""
+        return float(self.costs[level])
+
+    def range_cost(self, start, end):
+        """Total price of levels start..end-1"""
+        return float(self.cumulative[end] - self.cumulative[start])
+
+    def bulk_cost(self, level, count):
+        if count <= 0:
+            return 0
+        return self.range_cost(level, min(level + count, self.max_level))
+
+    def max_affordable(self, level, lines):
+        """Largest number of levels that can be bought with the given lines"""
+        if level >= self.max_level or lines <= 0:
+            return 0
+
+        target = self.cumulative[level] + lines
+        if np is not None:
+            end = int(np.searchsorted(self.cumulative, target, side='right')) - 1
+        else:
+            end = bisect_right(self.cumulative, target) - 1
+        end = min(end, self.max_level)
+
+        # The search adds before subtracting; settle rounding at the boundary
+        if end > level and self.range_cost(level, end) > lines:
+            end -= 1
+        return max(end - level, 0)
+
+
+def build_cost_tables(items, multiplier):
+    """CostTable for every item of a catalog section (UPGRADES, PASSIVE_ASSETS)"""
+    return {
+        item_id: CostTable(item['base_cost'], item['max_level'], multiplier)
+        for item_id, item in items.items()
+    }
+
+
+def cumulative_factors(multiplier, levels):
+    """Shared prefix table for the client: cost of levels a..b-1 is base_cost * (t[b] - t[a])"""
+    return [float(total) for total in prefix_sums(cost_factors(multiplier, levels))]
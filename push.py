@@ -0,0 +1,47 @@
+import json
+import queue
+import threading
+
+
+class EventBus:
+    """In-process publish/subscribe of push messages, keyed by player id
+
+    Each open stream gets its own bounded queue. Messages for players with no
+    open stream in this process are dropped; the next state response still
+    carries the change.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, player_id):
+        subscription = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(player_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, player_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(player_id)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[player_id]
+
+    def publish(self, player_id, event_type, data):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(player_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait((event_type, data))
+            except queue.Full:
+                # A stalled client shouldn't block the request that published
+                pass
+
+
+def format_sse(event_type, data):
+    """Encode one Server-Sent Events message"""
+    return f'event: {event_type}\ndata: {json.dumps(data)}\n\n'
@@ -0,0 +1,253 @@
+import numpy as np
+
+from catalog import (
+    ACHIEVEMENTS, CLICK_BASE_VALUE, PASSIVE_ASSETS, PRESTIGE_REQUIREMENT, THEMES,
+    UPGRADE_MULTIPLIER, UPGRADES
+)
+from engine import ACHIEVEMENT_COMPARATORS, achievement_conditions
+
+# Offline balance tool: advances a whole population of synthetic players at
+# once, with every per-player quantity held in a NumPy array. It follows the
+# engine's production and achievement rules up to the first prestige; random
+# events and their temporary multipliers are left out.
+
+
+def cheapest_first(sim, costs, affordable):
+    """Buy the cheapest affordable item"""
+    choice = np.where(affordable, costs, np.inf).argmin(axis=1)
+    return np.where(affordable.any(axis=1), choice, -1)
+
+
+def best_value(sim, costs, affordable):
+    """Buy the affordable item adding the most lines per second per line spent"""
+    gain = (sim.click_bonus * sim.click_rate[:, None] * sim.prestige_multiplier * sim.click_multiplier[:, None]
+            + sim.income * sim.prestige_multiplier * sim.passive_multiplier[:, None])
+    value = np.where(affordable, gain / costs, -np.inf)
+    return np.where(affordable.any(axis=1), value.argmax(axis=1), -1)
+
+
+POLICIES = {
+    'cheapest_first': cheapest_first,
+    'best_value': best_value
+}
+
+
+class PopulationSimulator:
+    """Thousands of synthetic players advanced in vectorized time steps
+
+    Each player clicks at their own steady rate (log-normal around
+    `clicks_per_second`) and spends lines as soon as the buying policy says
+    so. A policy is a function (sim, costs, affordable) -> item index per
+    player, or -1 to save; items are all upgrades followed by all assets.
+
+    Time steps grow with the elapsed time (`step_growth` of it, clamped to
+    [min_step, max_step]), so days of play take a few hundred steps at a
+    roughly constant relative resolution.
+    """
+
+    def __init__(self, players=1000, policy=cheapest_first, clicks_per_second=3.0, click_rate_spread=0.5,
+                 upgrade_multiplier=UPGRADE_MULTIPLIER, prestige_requirement=PRESTIGE_REQUIREMENT,
+                 upgrades=None, passive_assets=None, max_purchases_per_step=200,
+                 min_step=1.0, max_step=3600.0, step_growth=0.05, seed=0):
+        self.policy = POLICIES[policy] if isinstance(policy, str) else policy
+        self.upgrade_multiplier = upgrade_multiplier
+        self.prestige_requirement = prestige_requirement
+        self.max_purchases_per_step = max_purchases_per_step
+        self.min_step = min_step
+        self.max_step = max_step
+        self.step_growth = step_growth
+        self.prestige_multiplier = 1
+
+        upgrades = UPGRADES if upgrades is None else upgrades
+        passive_assets = PASSIVE_ASSETS if passive_assets is None else passive_assets
+        self.item_ids = list(upgrades) + list(passive_assets)
+        items = list(upgrades.values()) + list(passive_assets.values())
+        self.upgrade_count = len(upgrades)
+        self.is_upgrade = np.arange(len(items)) < self.upgrade_count
+        self.base_cost = np.array([item['base_cost'] for item in items], dtype=np.float64)
+        self.max_level = np.array([item['max_level'] for item in items], dtype=np.int64)
+        self.click_bonus = np.array([item.get('click_bonus', 0) for item in items], dtype=np.float64)
+        self.income = np.array([item.get('income', 0) for item in items], dtype=np.float64)
+
+        rng = np.random.default_rng(seed)
+        self.players = players
+        self.click_rate = clicks_per_second * rng.lognormal(0.0, click_rate_spread, players)
+
+        # Per-player state
+        self.time = 0.0
+        self.lines = np.zeros(players)
+        self.total_clicks = np.zeros(players)
+        self.levels = np.zeros((players, len(items)), dtype=np.int64)
+        self.click_flat = np.zeros(players)
+        self.click_multiplier = np.ones(players)
+        self.passive_flat = np.zeros(players)
+        self.passive_multiplier = np.ones(players)
+        self.code_per_click = np.full(players, float(CLICK_BASE_VALUE))
+        self.code_per_second = np.zeros(players)
+        # Price of the next level of every item for every player (inf when maxed)
+        self.next_costs = np.tile(self.base_cost, (players, 1))
+
+        # First time each milestone was reached, NaN until it is
+        self.theme_thresholds = sorted(THEMES)
+        self.theme_times = np.full((players, len(self.theme_thresholds)), np.nan)
+        self.achievement_ids = list(ACHIEVEMENTS)
+        self.achievement_times = np.full((players, len(self.achievement_ids)), np.nan)
+        self.prestige_times = np.full(players, np.nan)
+
+    def field(self, name):
+        """Per-player values of a state field used in achievement requirements"""
+        if name == 'lines_of_code':
+            return self.lines
+        if name in ('code_per_click', 'code_per_second', 'total_clicks'):
+            return getattr(self, name)
+        if name == 'longest_session':
+            # Synthetic players play in one uninterrupted session
+            return np.full(self.players, self.time)
+        section, _, key = name.partition('.')
+        if section in ('upgrades', 'passive_assets') and key in self.item_ids:
+            return self.levels[:, self.item_ids.index(key)]
+        upgrade_levels = self.levels[:, :self.upgrade_count]
+        asset_levels = self.levels[:, self.upgrade_count:]
+        if name == 'stats.upgrades_purchased':
+            return upgrade_levels.sum(axis=1)
+        if name == 'stats.assets_purchased':
+            return asset_levels.sum(axis=1)
+        if name == 'stats.upgrades_maxed':
+            return (upgrade_levels >= self.max_level[:self.upgrade_count]).sum(axis=1)
+        if name == 'stats.assets_maxed':
+            return (asset_levels >= self.max_level[self.upgrade_count:]).sum(axis=1)
+        # prestige_level and anything unknown: never reached before the first prestige
+        return np.zeros(self.players)
+
+    def recalculate_rates(self):
+        """Vectorized engine.recalculate_rates()"""
+        click_base = self.levels @ self.click_bonus
+        passive_base = self.levels @ self.income
+        self.code_per_click = ((CLICK_BASE_VALUE + click_base) * self.prestige_multiplier + self.click_flat) * self.click_multiplier
+        self.code_per_second = (passive_base * self.prestige_multiplier + self.passive_flat) * self.passive_multiplier
+
+    def buy(self):
+        """Let the policy spend lines, one level per player per round"""
+        players = np.arange(self.players)
+        costs = self.next_costs
+        for _ in range(self.max_purchases_per_step):
+            affordable = costs <= self.lines[:, None]
+            choice = self.policy(self, costs, affordable)
+            buying = choice >= 0
+            if not buying.any():
+                break
+            buyers, items = players[buying], choice[buying]
+            self.lines[buyers] -= costs[buyers, items]
+            self.levels[buyers, items] += 1
+
+            # Only the bought entries change price
+            costs[buyers, items] *= self.upgrade_multiplier
+            maxed = self.levels[buyers, items] >= self.max_level[items]
+            costs[buyers[maxed], items[maxed]] = np.inf
+            self.recalculate_rates()
+
+    def check_achievements(self):
+        """Unlock achievements whose requirements now hold and apply their rewards"""
+        for index, achievement_id in enumerate(self.achievement_ids):
+            achievement = ACHIEVEMENTS[achievement_id]
+            met = np.isnan(self.achievement_times[:, index])
+            for field, comparator, threshold in achievement_conditions(achievement):
+                met &= ACHIEVEMENT_COMPARATORS[comparator](self.field(field), threshold)
+            if not met.any():
+                continue
+
+            self.achievement_times[met, index] = self.time
+            reward = achievement['reward'] or {}
+            self.click_flat[met] += reward.get('click_bonus', 0)
+            self.click_multiplier[met] *= reward.get('click_multiplier', 1)
+            self.passive_flat[met] += reward.get('passive_bonus', 0)
+            self.passive_multiplier[met] *= reward.get('passive_multiplier', 1)
+            self.recalculate_rates()
+
+    def record_milestones(self):
+        for index, threshold in enumerate(self.theme_thresholds):
+            reached = np.isnan(self.theme_times[:, index]) & (self.lines >= threshold)
+            self.theme_times[reached, index] = self.time
+        reached = np.isnan(self.prestige_times) & (self.lines >= self.prestige_requirement)
+        self.prestige_times[reached] = self.time
+
+    def step(self):
+        """Advance every player by one time step"""
+        dt = min(max(self.time * self.step_growth, self.min_step), self.max_step)
+        clicks = self.click_rate * dt
+        self.lines += clicks * self.code_per_click + self.code_per_second * dt
+        self.total_clicks += clicks
+        self.time += dt
+
+        self.record_milestones()
+        self.check_achievements()
+        self.buy()
+        self.check_achievements()
+
+    def run(self, max_time=30 * 86400):
+        """Step until every player could prestige or `max_time` seconds have passed"""
+        self.record_milestones()
+        self.check_achievements()
+        while self.time < max_time and np.isnan(self.prestige_times).any():
+            self.step()
+        return self.report()
+
+    def report(self):
+        """Distributions of time-to-theme, time-to-prestige and achievement unlocks"""
+        return {
+            'players': self.players,
+            'simulated_seconds': self.time,
+            'themes': {
+                THEMES[threshold]['name']: summarize_times(self.theme_times[:, index])
+                for index, threshold in enumerate(self.theme_thresholds)
+            },
+            'prestige': summarize_times(self.prestige_times),
+            'achievements': {
+                achievement_id: summarize_times(self.achievement_times[:, index])
+                for index, achievement_id in enumerate(self.achievement_ids)
+            }
+        }
+
+
+def summarize_times(times):
+    """Share of players that got there and percentiles of when (seconds)"""
+    reached = times[~np.isnan(times)]
+    summary = {'reached': len(reached) / len(times)}
+    if len(reached):
+        p10, p50, p90 = np.percentile(reached, [10, 50, 90])
+        summary.update({'p10': float(p10), 'median': float(p50), 'p90': float(p90)})
+    return summary
+
+
+def simulate(max_time=30 * 86400, **params):
+    """Run one population with the given PopulationSimulator parameters"""
+    return PopulationSimulator(**params).run(max_time)
+
+
+def sweep(parameter, values, max_time=30 * 86400, **params):
+    """Report for each value of one simulator parameter, other parameters fixed"""
+    return {value: simulate(max_time, **{**params, parameter: value}) for value in values}
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description='Simulate a population of players')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='cheapest_first')
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--sweep', metavar='PARAMETER', help='e.g. upgrade_multiplier')
+    parser.add_argument('--values', type=float, nargs='*', default=[])
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    params = {'players': args.players, 'policy': args.policy}
+    if args.sweep:
+        result = sweep(args.sweep, args.values, args.days * 86400, **params)
+    else:
+        result = simulate(args.days * 86400, **params)
+    print(json.dumps(result, indent=2))
+    print(f'{time.perf_counter() - started:.1f}s', file=sys.stderr)
@@ -0,0 +1,290 @@
+from array import array
+from heapq import heapify, heappush
+
+from catalog import CLICK_BASE_VALUE, MAX_CLICK_BATCH_WINDOW, PASSIVE_ASSETS, UPGRADES
+
+# In-memory form of a player's game state. The engine works on these objects;
+# the nested dict layout (what the client, the delta log and the stores see)
+# is only produced at the edges with to_dict()/from_dict().
+#
+# Every class uses __slots__ so a state is a handful of small fixed-size
+# objects instead of a tree of dicts, and upgrade/asset levels are typed arrays
+# in catalog order: index i of `upgrades` is the level of UPGRADE_IDS[i].
+#
+# Everything that happens at a set time (event expiry, multiplier expiry, the
+# next event arrival) is also kept in a heap of (time, kind, key) entries,
+# so the next deadline is at the top and catching up only touches what fell
+# due. The heap is derived: it is rebuilt on from_dict() and never stored.
+# Entries are not removed when what they refer to goes away early (a
+# completed event, a replaced multiplier); engine.pop_deadline() skips them.
+#
+# Production is one stack of modifiers. Permanent sources (upgrades, assets,
+# achievements, prestige) are folded into the `production` aggregates and
+# from there into code_per_click and code_per_second. Temporary sources
+# (event rewards and penalties) are the entries of `temporary_multipliers`,
+# each with a target, a value and start and end times. Their product per
+# target at the state's current time is cached in `effective_multipliers`
+# and only recomputed when an entry starts or ends, see index_multipliers().
+
+UPGRADE_IDS = list(UPGRADES)
+ASSET_IDS = list(PASSIVE_ASSETS)
+UPGRADE_INDEX = {upgrade_id: index for index, upgrade_id in enumerate(UPGRADE_IDS)}
+ASSET_INDEX = {asset_id: index for index, asset_id in enumerate(ASSET_IDS)}
+
+LEVEL_TYPECODE = 'q'
+
+# What a temporary multiplier can apply to
+MULTIPLIER_TARGETS = ('click', 'passive')
+
+
+class Production:
+    """Aggregates that code_per_click and code_per_second are derived from"""
+
+    __slots__ = (
+        'click_base',          # sum of upgrade click_bonus * level
+        'click_flat',          # flat achievement bonuses
+        'click_multiplier',    # product of achievement click multipliers
+        'passive_base',        # sum of asset income * level
+        'passive_flat',
+        'passive_multiplier'
+    )
+
+    def __init__(self):
+        self.click_base = 0
+        self.click_flat = 0
+        self.click_multiplier = 1
+        self.passive_base = 0
+        self.passive_flat = 0
+        self.passive_multiplier = 1
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        production = cls()
+        for name in cls.__slots__:
+            if name in data:
+                setattr(production, name, data[name])
+        return production
+
+
+class Stats:
+    """Lifetime counters shown on the stats page and used by achievements"""
+
+    __slots__ = (
+        'total_lines_written',
+        'total_lines_from_clicks',
+        'total_lines_from_passive',
+        'total_prestiges',
+        'highest_lines_per_click',
+        'highest_lines_per_second',
+        'upgrades_purchased',
+        'assets_purchased',
+        'upgrades_maxed',
+        'assets_maxed',
+        'total_clicks'
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for name in cls.__slots__:
+            if name in data:
+                setattr(stats, name, data[name])
+        return stats
+
+
+class GameState:
+    """One player's game state"""
+
+    __slots__ = (
+        'lines_of_code',
+        'prestige_level',
+        'prestige_multiplier',
+        'code_per_click',
+        'code_per_second',
+        'upgrades',               # array of levels in UPGRADE_IDS order
+        'passive_assets',         # array of levels in ASSET_IDS order
+        'last_tick',
+        'theme',
+        'achievements',           # unlocked ids, in unlock order
+        'total_clicks',
+        'longest_session',
+        'last_session_start',
+        'next_event_roll',        # when the next special event arrives, see engine.trigger_event()
+        'active_events',
+        'event_cooldowns',        # event id -> time it can arrive again
+        'last_active',            # time of the player's last action, see engine.run_action()
+        'temporary_multipliers',  # source id -> {'target', 'value', 'start_time', 'end_time'}
+        'effective_multipliers',  # target -> product of the temporary multipliers in effect
+        'multipliers_since',      # target -> when its effective multiplier last changed
+        'bulk_buy_mode',
+        'special_unlocks',
+        'version',                # bumped on every saved change, see game.save_game_state()
+        'rng_seed',               # seeds the random source of each change, see engine.transition_rng()
+        'production',
+        'stats',
+        'extras',                 # keys this class doesn't know, kept for to_dict()
+        'deadlines'               # heap of (time, kind, key), see index_deadlines()
+    )
+
+    def __init__(self, now=0, rng_seed=None):
+        self.lines_of_code = 0
+        self.prestige_level = 0
+        self.prestige_multiplier = 1
+        self.code_per_click = CLICK_BASE_VALUE
+        self.code_per_second = 0
+        self.upgrades = array(LEVEL_TYPECODE, [0]) * len(UPGRADE_IDS)
+        self.passive_assets = array(LEVEL_TYPECODE, [0]) * len(ASSET_IDS)
+        self.last_tick = now
+        self.theme = 'notepad.css'
+        self.achievements = []
+        self.total_clicks = 0
+        self.longest_session = 0
+        self.last_session_start = now
+        self.next_event_roll = 0
+        self.active_events = []
+        self.event_cooldowns = {}
+        self.last_active = 0
+        self.temporary_multipliers = {}
+        self.effective_multipliers = dict.fromkeys(MULTIPLIER_TARGETS, 1)
+        self.multipliers_since = dict.fromkeys(MULTIPLIER_TARGETS, 0)
+        self.bulk_buy_mode = {'upgrades': 1, 'assets': 1}  # Default to buying 1 at a time
+        self.special_unlocks = None
+        self.version = 0
+        self.rng_seed = rng_seed
+        self.production = Production()
+        self.stats = Stats()
+        self.extras = None
+        self.index_deadlines()
+
+    def upgrade_level(self, upgrade_id):
+        return self.upgrades[UPGRADE_INDEX[upgrade_id]]
+
+    def asset_level(self, asset_id):
+        return self.passive_assets[ASSET_INDEX[asset_id]]
+
+    def schedule(self, when, kind, key=''):
+        heappush(self.deadlines, (when, kind, key))
+
+    def index_deadlines(self):
+        """Rebuild the deadline heap from the events, multipliers and next event arrival
+
+        A multiplier has two: its end, when the effective multipliers change,
+        and MAX_CLICK_BATCH_WINDOW seconds later, when it is dropped (see
+        engine.click()).
+        """
+        deadlines = [(self.next_event_roll, 'roll', '')]
+        deadlines.extend((event['end_time'], 'event', event['id'])
+                         for event in self.active_events if not event.get('completed'))
+        for mult_id, m in self.temporary_multipliers.items():
+            if m['end_time'] > self.last_tick:
+                deadlines.append((m['end_time'], 'multiplier_end', mult_id))
+            deadlines.append((m['end_time'] + MAX_CLICK_BATCH_WINDOW, 'multiplier', mult_id))
+        heapify(deadlines)
+        self.deadlines = deadlines
+
+    def index_multipliers(self, now):
+        """Recompute the cached effective multipliers as of `now`"""
+        effective = dict.fromkeys(MULTIPLIER_TARGETS, 1)
+        since = dict.fromkeys(MULTIPLIER_TARGETS, 0)
+        for mult_id, m in self.temporary_multipliers.items():
+            # Saves from before targets were recorded keyed them by target
+            target = m.get('target', mult_id)
+            if target not in effective:
+                continue
+            start = m.get('start_time', 0)
+            if start <= now < m['end_time']:
+                effective[target] *= m['value']
+            for boundary in (start, m['end_time']):
+                if since[target] < boundary <= now:
+                    since[target] = boundary
+        self.effective_multipliers = effective
+        self.multipliers_since = since
+
+    def to_dict(self):
+        """The state as the nested dicts and lists the client and stores use"""
+        data = {
+            'lines_of_code': self.lines_of_code,
+            'prestige_level': self.prestige_level,
+            'prestige_multiplier': self.prestige_multiplier,
+            'code_per_click': self.code_per_click,
+            'code_per_second': self.code_per_second,
+            'upgrades': dict(zip(UPGRADE_IDS, self.upgrades)),
+            'passive_assets': dict(zip(ASSET_IDS, self.passive_assets)),
+            'last_tick': self.last_tick,
+            'theme': self.theme,
+            'achievements': list(self.achievements),
+            'total_clicks': self.total_clicks,
+            'longest_session': self.longest_session,
+            'last_session_start': self.last_session_start,
+            'next_event_roll': self.next_event_roll,
+            'active_events': [dict(event) for event in self.active_events],
+            'event_cooldowns': dict(self.event_cooldowns),
+            'last_active': self.last_active,
+            'temporary_multipliers': {k: dict(m) for k, m in self.temporary_multipliers.items()},
+            'effective_multipliers': dict(self.effective_multipliers),
+            'bulk_buy_mode': dict(self.bulk_buy_mode),
+            'version': self.version,
+            'rng_seed': self.rng_seed,
+            'production': self.production.to_dict(),
+            'stats': self.stats.to_dict()
+        }
+        if self.special_unlocks:
+            data['special_unlocks'] = list(self.special_unlocks)
+        if self.extras:
+            data.update(self.extras)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a state from its dict form
+
+        Missing keys get their new-game defaults and levels of items no longer
+        in the catalog are dropped. Derived data (production aggregates, maxed
+        counters) is taken as stored; see engine.restore_state() for the
+        migration of older saves.
+        """
+        game_state = cls(data.get('last_tick', 0))
+        for name in ('lines_of_code', 'prestige_level', 'prestige_multiplier', 'code_per_click',
+                     'code_per_second', 'theme', 'total_clicks', 'longest_session',
+                     'last_session_start', 'next_event_roll', 'last_active', 'version', 'rng_seed'):
+            if name in data:
+                setattr(game_state, name, data[name])
+
+        for upgrade_id, level in data.get('upgrades', {}).items():
+            if upgrade_id in UPGRADE_INDEX:
+                game_state.upgrades[UPGRADE_INDEX[upgrade_id]] = int(level)
+        for asset_id, level in data.get('passive_assets', {}).items():
+            if asset_id in ASSET_INDEX:
+                game_state.passive_assets[ASSET_INDEX[asset_id]] = int(level)
+
+        game_state.achievements = list(data.get('achievements', []))
+        game_state.active_events = [dict(event) for event in data.get('active_events', [])]
+        game_state.event_cooldowns = dict(data.get('event_cooldowns', {}))
+        game_state.temporary_multipliers = {k: dict(m) for k, m in data.get('temporary_multipliers', {}).items()}
+        if 'bulk_buy_mode' in data:
+            game_state.bulk_buy_mode = dict(data['bulk_buy_mode'])
+        if data.get('special_unlocks'):
+            game_state.special_unlocks = list(data['special_unlocks'])
+        if 'production' in data:
+            game_state.production = Production.from_dict(data['production'])
+        if 'stats' in data:
+            game_state.stats = Stats.from_dict(data['stats'])
+
+        extras = {k: v for k, v in data.items() if k not in KNOWN_KEYS}
+        game_state.extras = extras or None
+        game_state.index_multipliers(game_state.last_tick)
+        game_state.index_deadlines()
+        return game_state
+
+
+KNOWN_KEYS = frozenset(GameState.__slots__) - {'extras', 'deadlines', 'multipliers_since'}
@@ -0,0 +1,519 @@
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+from codec import CodecError, decode_state, encode_state
+
+try:
+    import fcntl
+except ImportError:  # Windows: nothing stops a second process
+    fcntl = None
+
+
+class VersionConflict(Exception):
+    """The stored state changed since it was loaded; reload and try again"""
+
+
+class JournalLocked(Exception):
+    """Another process has the journal open"""
+
+
+def connection_local():
+    """Holder for per-thread SQLite connections
+
+    Under gevent workers (see gunicorn.conf.py) threading.local is per
+    greenlet, which would open a connection for every request and keep one
+    per open event stream. The unpatched one keeps a connection per OS
+    thread, shared by the greenlets on it; SQLite calls never switch
+    greenlets, so their transactions don't interleave.
+    """
+    try:
+        from gevent.monkey import get_original
+    except ImportError:
+        return threading.local()
+    return get_original('_thread', '_local')()
+
+
+def state_version(game_state):
+    return game_state.get('version', 0) if game_state is not None else None
+
+
+class GameStore:
+    """Base class for game state persistence backends, keyed by player id"""
+
+    def load(self, player_id):
+        """Return the stored game state for a player, or None"""
+        raise NotImplementedError
+
+    def save(self, player_id, game_state):
+        """Persist the full game state for a player"""
+        raise NotImplementedError
+
+    def save_many(self, items):
+        """Persist several (player_id, game_state) pairs"""
+        for player_id, game_state in items:
+            self.save(player_id, game_state)
+
+    def compare_and_save(self, player_id, game_state, expected_version):
+        """Save only if the stored state still has `expected_version`
+
+        `expected_version` None means no state may be stored yet. Raises
+        VersionConflict otherwise. Backends override this with an atomic
+        version; this fallback only suits single-threaded use.
+        """
+        if state_version(self.load(player_id)) != expected_version:
+            raise VersionConflict(player_id)
+        self.save(player_id, game_state)
+
+    def delete(self, player_id):
+        """Forget a player's game state"""
+        raise NotImplementedError
+
+    def flush(self, player_id=None):
+        """Make saved states durable (one player's, or everyone's)
+
+        Stores that write through have nothing to do.
+        """
+
+    def close(self):
+        pass
+
+
+def load_blob(data):
+    """Decode a stored state; rows written before the binary codec hold JSON text"""
+    if isinstance(data, str):
+        return json.loads(data)
+    return decode_state(data)
+
+
+class MemoryGameStore(GameStore):
+    """Keeps game states in process memory (bots, local experiments)"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def load(self, player_id):
+        with self._lock:
+            _, data = self._states.get(player_id, (None, None))
+        # Hand out a copy so callers never mutate the stored state in place
+        return decode_state(data) if data is not None else None
+
+    def save(self, player_id, game_state):
+        data = encode_state(game_state)
+        with self._lock:
+            self._states[player_id] = (state_version(game_state), data)
+
+    def compare_and_save(self, player_id, game_state, expected_version):
+        data = encode_state(game_state)
+        with self._lock:
+            version, _ = self._states.get(player_id, (None, None))
+            if version != expected_version:
+                raise VersionConflict(player_id)
+            self._states[player_id] = (state_version(game_state), data)
+
+    def delete(self, player_id):
+        with self._lock:
+            self._states.pop(player_id, None)
+
+
+class SQLiteGameStore(GameStore):
+    """Embedded SQLite backend running in WAL mode
+
+    Each thread gets its own connection; WAL lets page loads read while
+    another worker is writing a click.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = connection_local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS game_states ('
+            ' player_id TEXT PRIMARY KEY,'
+            ' state BLOB NOT NULL,'
+            ' updated_at REAL NOT NULL,'
+            ' version INTEGER NOT NULL DEFAULT 0)'
+        )
+        self._add_version_column(conn)
+        conn.commit()
+
+    def _add_version_column(self, conn):
+        """Databases from before compare_and_save() keep the version only in the state"""
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(game_states)')]
+        if 'version' in columns:
+            return
+        conn.execute('ALTER TABLE game_states ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        rows = conn.execute('SELECT player_id, state FROM game_states').fetchall()
+        conn.executemany('UPDATE game_states SET version = ? WHERE player_id = ?',
+                         [(state_version(load_blob(state)), player_id) for player_id, state in rows])
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # WAL is crash safe with NORMAL sync; FULL would fsync on every click
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, player_id):
+        row = self._connect().execute(
+            'SELECT state FROM game_states WHERE player_id = ?', (player_id,)
+        ).fetchone()
+        return load_blob(row[0]) if row else None
+
+    def save(self, player_id, game_state):
+        self.save_many([(player_id, game_state)])
+
+    def save_many(self, items):
+        # One transaction for the whole batch
+        now = datetime.now().timestamp()
+        conn = self._connect()
+        conn.executemany(
+            'INSERT INTO game_states (player_id, state, updated_at, version) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(player_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at, '
+            'version = excluded.version',
+            [(player_id, encode_state(game_state), now, state_version(game_state)) for player_id, game_state in items]
+        )
+        conn.commit()
+
+    def compare_and_save(self, player_id, game_state, expected_version):
+        conn = self._connect()
+        values = (encode_state(game_state), datetime.now().timestamp(), state_version(game_state))
+        if expected_version is None:
+            cursor = conn.execute(
+                'INSERT INTO game_states (state, updated_at, version, player_id) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(player_id) DO NOTHING',
+                values + (player_id,)
+            )
+        else:
+            cursor = conn.execute(
+                'UPDATE game_states SET state = ?, updated_at = ?, version = ? '
+                'WHERE player_id = ? AND version = ?',
+                values + (player_id, expected_version)
+            )
+        conn.commit()
+        if cursor.rowcount == 0:
+            raise VersionConflict(player_id)
+
+    def delete(self, player_id):
+        conn = self._connect()
+        conn.execute('DELETE FROM game_states WHERE player_id = ?', (player_id,))
+        conn.commit()
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class Journal:
+    """Append-only log of saved states, in numbered segment files
+
+    Each record is the codec encoding of one saved state, framed as
+    crc32 | state length | player id length | player id | state. Records are
+    written straight to the OS, so they survive the process crashing; fsync()
+    makes them survive the machine crashing too. A torn record at the end of
+    a segment (a crash mid-write) ends the replay of that segment.
+
+    One process owns the journal: it holds a lock on `path`.lock while open,
+    since a second one would retire segments the first still needs. Opening
+    waits up to `lock_timeout` seconds for it, so a worker started by a
+    reload can take over from the one it replaces once that one exits.
+    """
+
+    HEADER = struct.Struct('<IIH')
+    LOCK_RETRY_INTERVAL = 0.1
+
+    def __init__(self, path, lock_timeout=60.0):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock_file = open(f'{path}.lock', 'a')
+        try:
+            self._lock(lock_timeout)
+        except JournalLocked:
+            self._lock_file.close()
+            raise
+        sequences = self.segments()
+        self.sequence = sequences[-1] + 1 if sequences else 1
+        self._file = self._open()
+
+    def _lock(self, timeout):
+        if fcntl is None:
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise JournalLocked(f'{self.path} is still in use by another process after {timeout:g}s; '
+                                        'the cache needs a single worker or a journal per process') from None
+            # Polled rather than blocking in flock(), which would stall a gevent worker
+            time.sleep(self.LOCK_RETRY_INTERVAL)
+
+    def segments(self):
+        """Sequence numbers of the segment files on disk, oldest first"""
+        directory, prefix = os.path.split(self.path)
+        sequences = []
+        for name in os.listdir(directory or '.'):
+            head, _, sequence = name.rpartition('.')
+            if head == prefix and sequence.isdigit():
+                sequences.append(int(sequence))
+        return sorted(sequences)
+
+    def segment_path(self, sequence):
+        return f'{self.path}.{sequence}'
+
+    def _open(self):
+        return open(self.segment_path(self.sequence), 'ab', buffering=0)
+
+    def append(self, player_id, data):
+        """Log a state given as encode_state() output"""
+        key = player_id.encode()
+        body = key + data
+        header = self.HEADER.pack(zlib.crc32(body, zlib.crc32(struct.pack('<IH', len(data), len(key)))),
+                                  len(data), len(key))
+        self._file.write(header + body)
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """Start a new segment; returns the sequence of the last finished one"""
+        self.sync()
+        self._file.close()
+        finished = self.sequence
+        self.sequence += 1
+        self._file = self._open()
+        return finished
+
+    def remove_through(self, sequence):
+        """Delete the segments up to and including `sequence`"""
+        for old in self.segments():
+            if old <= sequence:
+                os.remove(self.segment_path(old))
+
+    def replay(self):
+        """Latest journaled state per player, across all segments"""
+        states = {}
+        for sequence in self.segments():
+            with open(self.segment_path(sequence), 'rb') as f:
+                data = f.read()
+            pos = 0
+            while pos + self.HEADER.size <= len(data):
+                crc, state_length, key_length = self.HEADER.unpack_from(data, pos)
+                start = pos + self.HEADER.size
+                end = start + key_length + state_length
+                body = data[start:end]
+                if end > len(data) or zlib.crc32(body, zlib.crc32(data[pos + 4:start])) != crc:
+                    break
+                try:
+                    states[body[:key_length].decode()] = decode_state(body[key_length:])
+                except (CodecError, UnicodeDecodeError):
+                    break
+                pos = end
+        return states
+
+    def close(self):
+        self._file.close()
+        self._lock_file.close()
+
+
+class CachedGameStore(GameStore):
+    """Write-behind LRU cache of hot game states in front of another store
+
+    Saves only update the cache and append to the journal; dirty states
+    reach the backing store in one batch every `flush_interval` seconds, when
+    they are evicted, or on flush(). On start, states left in the journal by
+    a crash are written to the backing store first.
+
+    States are cached as (version, encode_state() bytes), the same bytes the
+    journal gets, so a cached player costs a few hundred bytes rather than
+    the several KB of a state dict; loads decode a fresh copy. The cache
+    belongs to one process, so every
+    request of a player has to reach the same process: run a single worker
+    (threads scale within it) or route players stickily.
+    """
+
+    def __init__(self, backing, journal_path, capacity=10_000, flush_interval=5.0):
+        self.backing = backing
+        self.capacity = capacity
+        self._entries = OrderedDict()   # player id -> (version, encoded state), most recently used last
+        self._dirty = set()
+        self._evicting = {}              # evicted dirty entries not yet in the backing store
+        self._lock = threading.Lock()
+        # Serializes writes to the backing store, so an older state never
+        # lands after a newer one
+        self._write_lock = threading.Lock()
+
+        self.journal = Journal(journal_path)
+        self._recover()
+
+        self._stopped = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                                             name='game-store-flush', daemon=True)
+            self._flusher.start()
+
+    def _recover(self):
+        finished = self.journal.sequence - 1
+        states = self.journal.replay()
+        if states:
+            self.backing.save_many(states.items())
+        self.journal.remove_through(finished)
+
+    def _cached(self, player_id):
+        entry = self._entries.get(player_id)
+        if entry is not None:
+            self._entries.move_to_end(player_id)
+            return entry
+        return self._evicting.get(player_id)
+
+    def load(self, player_id):
+        with self._lock:
+            entry = self._cached(player_id)
+        if entry is not None:
+            return decode_state(entry[1])
+
+        game_state = self.backing.load(player_id)
+        if game_state is not None:
+            entry = (state_version(game_state), encode_state(game_state))
+            with self._lock:
+                # A save that raced this load wins
+                cached = self._entries.setdefault(player_id, entry)
+            self._evict()
+            if cached is not entry:
+                return decode_state(cached[1])
+        return game_state
+
+    def save(self, player_id, game_state):
+        entry = (state_version(game_state), encode_state(game_state))
+        with self._lock:
+            self._save_locked(player_id, entry)
+        self._evict()
+
+    def compare_and_save(self, player_id, game_state, expected_version):
+        entry = (state_version(game_state), encode_state(game_state))
+        with self._lock:
+            current = self._cached(player_id)
+        if current is None:
+            # Bring the stored state into the cache, if there is one, so the
+            # version check below sees it
+            self.load(player_id)
+        with self._lock:
+            current = self._cached(player_id)
+            if (current[0] if current is not None else None) != expected_version:
+                raise VersionConflict(player_id)
+            self._save_locked(player_id, entry)
+        self._evict()
+
+    def _save_locked(self, player_id, entry):
+        self.journal.append(player_id, entry[1])
+        self._entries[player_id] = entry
+        self._entries.move_to_end(player_id)
+        self._dirty.add(player_id)
+
+    def delete(self, player_id):
+        with self._lock:
+            self._entries.pop(player_id, None)
+            self._evicting.pop(player_id, None)
+            self._dirty.discard(player_id)
+        with self._write_lock:
+            self.backing.delete(player_id)
+
+    def _evict(self):
+        """Drop least recently used states over capacity, writing dirty ones"""
+        with self._lock:
+            evicted = []
+            while len(self._entries) > self.capacity:
+                player_id, entry = self._entries.popitem(last=False)
+                if player_id in self._dirty:
+                    self._dirty.discard(player_id)
+                    self._evicting[player_id] = entry
+                    evicted.append(player_id)
+        if not evicted:
+            return
+
+        with self._write_lock:
+            with self._lock:
+                # Players saved again since are back in the cache and dirty
+                items = [(player_id, self._evicting[player_id][1]) for player_id in evicted
+                         if player_id in self._evicting and player_id not in self._entries]
+            if items:
+                self.backing.save_many([(player_id, decode_state(data)) for player_id, data in items])
+            with self._lock:
+                for player_id in evicted:
+                    self._evicting.pop(player_id, None)
+
+    def flush(self, player_id=None):
+        """Write dirty states to the backing store: one player's, or all of them
+
+        A full flush also retires the journal segments it covered, so it
+        writes the states being evicted too: their only other copy is there.
+        """
+        with self._write_lock:
+            with self._lock:
+                if player_id is None:
+                    dirty, self._dirty = self._dirty, set()
+                    finished = self.journal.rotate()
+                elif player_id in self._dirty:
+                    dirty = {player_id}
+                    self._dirty.discard(player_id)
+                    finished = None
+                else:
+                    return
+                items = [(p, self._entries[p]) for p in dirty if p in self._entries]
+                evicting = []
+                if player_id is None:
+                    evicting = [(p, entry) for p, entry in self._evicting.items() if p not in self._entries]
+
+            try:
+                if items or evicting:
+                    self.backing.save_many([(p, decode_state(entry[1])) for p, entry in items + evicting])
+            except Exception:
+                with self._lock:
+                    self._dirty.update(dirty)
+                raise
+            with self._lock:
+                for p, entry in evicting:
+                    if self._evicting.get(p) is entry:
+                        del self._evicting[p]
+            if finished is not None:
+                self.journal.remove_through(finished)
+
+    def _flush_periodically(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                # Still in the cache and the journal; the next round retries
+                pass
+
+    def close(self):
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        self.journal.close()
+        self.backing.close()
+
+
+def create_store(url):
+    """Build a store from a simple URL: 'memory://' or 'sqlite:///path/to.db'"""
+    if url == 'memory://':
+        return MemoryGameStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteGameStore(url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported game store: {url}')
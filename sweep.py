@@ -0,0 +1,183 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from catalog import CATALOG_HASH, PASSIVE_ASSETS, THEMES, UPGRADES
+from simulator import simulate
+
+# Parameter sweeps over the simulator, fanned out across a process pool.
+#
+# A grid maps parameter names to lists of values (a scalar is a fixed value).
+# Names are PopulationSimulator arguments (upgrade_multiplier,
+# prestige_requirement, clicks_per_second, policy, players, ...) or catalog
+# overrides:
+#   cost_scale.tier<N>      multiply base_cost of every tier N upgrade and asset
+#   click_bonus.<upgrade>   set one upgrade's click_bonus
+#   income.<asset>          set one asset's income
+#   click_bonus_scale       multiply every click_bonus
+#   income_scale            multiply every income
+#
+# Every finished run is written to the checkpoint directory on its own, so an
+# interrupted sweep picks up where it stopped when run again. Checkpoints are
+# named after the parameters, the simulated time and the catalog hash, so a
+# rerun with another --days or after a catalog change doesn't reuse them.
+
+CATALOG_OVERRIDES = ('cost_scale.', 'click_bonus.', 'income.', 'click_bonus_scale', 'income_scale')
+
+
+def expand_grid(grid):
+    """Every combination of the grid's values, as a list of parameter dicts"""
+    names = sorted(grid)
+    choices = [grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names]
+    return [dict(zip(names, values)) for values in itertools.product(*choices)]
+
+
+def run_key(params, max_time):
+    """Stable name of a run, used for its checkpoint file"""
+    run = {'params': params, 'max_time': float(max_time), 'catalog': CATALOG_HASH}
+    encoded = json.dumps(run, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+def apply_overrides(params):
+    """Turn a parameter set into simulate() arguments with an adjusted catalog"""
+    upgrades = {k: dict(v) for k, v in UPGRADES.items()}
+    passive_assets = {k: dict(v) for k, v in PASSIVE_ASSETS.items()}
+    sim_params = {}
+
+    for name, value in params.items():
+        if name.startswith('cost_scale.tier'):
+            tier = int(name[len('cost_scale.tier'):])
+            for item in (*upgrades.values(), *passive_assets.values()):
+                if item.get('tier') == tier:
+                    item['base_cost'] *= value
+        elif name.startswith('click_bonus.'):
+            upgrades[name[len('click_bonus.'):]]['click_bonus'] = value
+        elif name.startswith('income.'):
+            passive_assets[name[len('income.'):]]['income'] = value
+        elif name == 'click_bonus_scale':
+            for item in upgrades.values():
+                item['click_bonus'] *= value
+        elif name == 'income_scale':
+            for item in passive_assets.values():
+                item['income'] *= value
+        else:
+            sim_params[name] = value
+
+    if any(name.startswith(CATALOG_OVERRIDES) for name in params):
+        sim_params['upgrades'] = upgrades
+        sim_params['passive_assets'] = passive_assets
+    return sim_params
+
+
+def run_one(params, max_time):
+    """Worker entry point: simulate one parameter set"""
+    return simulate(max_time, **apply_overrides(params))
+
+
+def checkpoint_path(checkpoint_dir, key):
+    return os.path.join(checkpoint_dir, f'{key}.json')
+
+
+def load_checkpoint(checkpoint_dir, key):
+    try:
+        with open(checkpoint_path(checkpoint_dir, key)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        # Missing, or cut short by a crash: run it again
+        return None
+
+
+def save_checkpoint(checkpoint_dir, key, params, report):
+    path = checkpoint_path(checkpoint_dir, key)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'params': params, 'report': report}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic on POSIX and Windows: a checkpoint is either complete or absent
+    os.replace(tmp_path, path)
+
+
+def run_sweep(grid, checkpoint_dir, max_time=30 * 86400, workers=None, progress=None):
+    """Run every parameter set of the grid not already checkpointed
+
+    Returns the results of the whole grid (finished earlier or now) in grid
+    order, each as {'key', 'params', 'report'}.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    runs = [(run_key(params, max_time), params) for params in expand_grid(grid)]
+    results = {}
+    for key, params in runs:
+        checkpoint = load_checkpoint(checkpoint_dir, key)
+        if checkpoint is not None:
+            results[key] = checkpoint['report']
+
+    pending = [(key, params) for key, params in runs if key not in results]
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_one, params, max_time): (key, params) for key, params in pending}
+            for future in as_completed(futures):
+                key, params = futures[future]
+                results[key] = future.result()
+                save_checkpoint(checkpoint_dir, key, params, results[key])
+                if progress:
+                    progress(len(results), len(runs))
+
+    return [{'key': key, 'params': params, 'report': results[key]} for key, params in runs]
+
+
+def comparison_rows(results):
+    """One flat row per parameter set, fastest median prestige first"""
+    rows = []
+    for result in results:
+        report = result['report']
+        row = {'key': result['key'], **result['params']}
+        row['prestige_reached'] = report['prestige']['reached']
+        row['prestige_median_h'] = report['prestige'].get('median', float('nan')) / 3600
+        row['prestige_p90_h'] = report['prestige'].get('p90', float('nan')) / 3600
+        for threshold in sorted(THEMES):
+            name = THEMES[threshold]['name']
+            row[f'{name}_median_h'] = report['themes'][name].get('median', float('nan')) / 3600
+        rows.append(row)
+    rows.sort(key=lambda row: (-row['prestige_reached'], row['prestige_median_h']))
+    return rows
+
+
+def write_report(results, path):
+    """Merge all runs into one CSV comparison table"""
+    rows = comparison_rows(results)
+    fields = []
+    for row in rows:
+        fields.extend(name for name in row if name not in fields)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a simulator parameter sweep on all cores')
+    parser.add_argument('grid', help='JSON file mapping parameter names to lists of values')
+    parser.add_argument('--out', default='sweep_results', help='checkpoint and report directory')
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of CPUs')
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+
+    results = run_sweep(grid, args.out, args.days * 86400, args.workers,
+                        progress=lambda done, total: print(f'{done}/{total}', flush=True))
+    report_path = os.path.join(args.out, 'report.csv')
+    rows = write_report(results, report_path)
+    for row in rows[:10]:
+        params = {k: v for k, v in row.items() if k in results[0]['params']}
+        print(f"{row['prestige_median_h']:8.1f}h  {row['prestige_reached']:.0%}  {params}")
+    print(f'Report written to {report_path}')
@@ -0,0 +1,68 @@
+import random
+import zlib
+
+import pytest
+
+import engine
+from codec import (
+    ACHIEVEMENT_IDS, ASSET_IDS, FLAG_ZLIB, MAGIC, MAX_STATE_BYTES, SCHEMA_VERSION, THEME_CSS, UPGRADE_IDS,
+    CodecError, decode_state, encode_state
+)
+from catalog import ACHIEVEMENTS, PASSIVE_ASSETS, THEMES, UPGRADES
+
+
+def sample_state():
+    game_state = engine.get_new_game_state(1000, rng_seed=1).to_dict()
+    game_state['achievements'] = ['first_line', 'first_upgrade']
+    return game_state
+
+
+def test_round_trip():
+    game_state = sample_state()
+    for compress in (False, True):
+        assert decode_state(encode_state(game_state, compress)) == game_state
+
+
+def test_round_trip_multi_byte_varints():
+    # One-, two-, three- and more-byte varints side by side, including where
+    # the tokenizer could skip the first byte of a long one
+    for levels in ([20000] * 3, [1, 200, 20000, 2 ** 21, 5, 2 ** 40, 0], [2 ** 14 - 1, 2 ** 14]):
+        game_state = sample_state()
+        for upgrade_id, level in zip(UPGRADE_IDS, levels):
+            game_state['upgrades'][upgrade_id] = level
+        for asset_id, level in zip(reversed(ASSET_IDS), levels):
+            game_state['passive_assets'][asset_id] = level
+        game_state['total_clicks'] = levels[-1]
+        assert decode_state(encode_state(game_state)) == game_state
+
+
+def test_round_trip_random_levels():
+    rng = random.Random(7)
+    for _ in range(200):
+        game_state = sample_state()
+        for levels in (game_state['upgrades'], game_state['passive_assets']):
+            for item_id in levels:
+                levels[item_id] = rng.choice((0, rng.randrange(128), rng.randrange(2 ** 14), rng.randrange(2 ** 30)))
+        assert decode_state(encode_state(game_state)) == game_state
+
+
+def test_frozen_numbering_covers_catalog():
+    # A catalog item missing here still round-trips, but only through JSON
+    assert set(UPGRADES) <= set(UPGRADE_IDS)
+    assert set(PASSIVE_ASSETS) <= set(ASSET_IDS)
+    assert set(ACHIEVEMENTS) <= set(ACHIEVEMENT_IDS)
+    assert {theme['css'] for theme in THEMES.values()} <= set(THEME_CSS)
+
+
+def test_item_unknown_to_numbering_round_trips():
+    game_state = sample_state()
+    game_state['upgrades']['not_numbered_yet'] = 3
+    game_state['achievements'].append('not_numbered_yet')
+    assert decode_state(encode_state(game_state)) == game_state
+
+
+def test_compressed_state_inflating_past_limit_is_rejected():
+    bomb = MAGIC + bytes((SCHEMA_VERSION, FLAG_ZLIB)) + zlib.compress(bytes(MAX_STATE_BYTES * 50), 9)
+    assert len(bomb) < MAX_STATE_BYTES // 10
+    with pytest.raises(CodecError):
+        decode_state(bomb)
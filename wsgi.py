@@ -0,0 +1,4 @@
+from game import create_app
+
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()